@@ -23,12 +23,14 @@
 # =============================================================================
 #
 
+import os
 import numpy
-from glue.ligolw import table, lsctables, utils
-import sys, glue
-from collections import defaultdict
+from glue.ligolw import ligolw, lsctables, utils
+from optparse import OptionParser
 from gstlal import reference_psd
 
+from eputils import read_table_array, TableArrayStream
+
 #
 # =============================================================================
 #
@@ -38,33 +40,106 @@ from gstlal import reference_psd
 #
 
 # amplitude definitions
-def new_compute_amplitude( sb, psd ):
+def inverse_psd_table( psd ):
+        """
+        Precompute the cumulative sum of deltaF/S(f), so that the integral of 1/S over any band is the difference of two entries.
+        """
+        return numpy.concatenate( ([0.], numpy.cumsum( 1/numpy.asarray(psd.data)*psd.deltaF )) )
+
+def band_inverse_psd( central_freq, bandwidth, psd, cumulative=None ):
+        """
+        Integrate 1/S(f) over the bands [central_freq - bandwidth/2, central_freq + bandwidth/2) of a set of tiles, as arrays, using the same bins as psd.data[flow:fhigh]. Bins outside the PSD are left out. cumulative is the output of inverse_psd_table, which is computed if not given.
+        """
+        if cumulative is None:
+                cumulative = inverse_psd_table( psd )
+        nbins = len(cumulative) - 1
+        # int() truncates towards zero
+        flow = numpy.trunc((central_freq - bandwidth/2.0 - psd.f0)/psd.deltaF).astype(int)
+        fhigh = numpy.trunc((central_freq + bandwidth/2.0 - psd.f0)/psd.deltaF).astype(int)
+        flow = numpy.clip(flow, 0, nbins)
+        fhigh = numpy.clip(fhigh, flow, nbins)
+        return cumulative[fhigh] - cumulative[flow]
+
+def new_compute_amplitude( snr, bandwidth, inv_band ):
         """
         Replaced <S> with 1/<1/S> in hrss def'n. Use snr_r = E/d-1
         """
-        flow = int((sb.central_freq - sb.bandwidth/2.0 - psd.f0)/psd.deltaF)
-        fhigh = int((sb.central_freq + sb.bandwidth/2.0 - psd.f0)/psd.deltaF)
-        sb.amplitude = numpy.sqrt(  1./2. * sb.snr / ( ( 1/psd.data[flow:fhigh]*psd.deltaF ).sum() / sb.bandwidth ) )
+        return numpy.sqrt(  1./2. * snr / ( inv_band / bandwidth ) )
 
-def tile_energy_E_new_compute_amplitude( sb, psd):
+def tile_energy_E_new_compute_amplitude( snr, bandwidth, duration, inv_band ):
         """
         Replaced <S> with 1/<1/S> in hrss def'n. Use snr = E
         """
-        flow = int((sb.central_freq - sb.bandwidth/2.0 - psd.f0)/psd.deltaF)
-        fhigh = int((sb.central_freq + sb.bandwidth/2.0 - psd.f0)/psd.deltaF)
-        ndof = sb.duration*sb.bandwidth*2.
-        snr = (sb.snr+1.)*ndof
-        sb.amplitude = numpy.sqrt(  1./2. * snr / ( ( 1/psd.data[flow:fhigh]*psd.deltaF ).sum() / sb.bandwidth ) )
+        ndof = duration*bandwidth*2.
+        return new_compute_amplitude( (snr+1.)*ndof, bandwidth, inv_band )
 
-def tile_energy_Eminusd_new_compute_amplitude( sb, psd):
+def tile_energy_Eminusd_new_compute_amplitude( snr, bandwidth, duration, inv_band ):
         """
         Replaced <S> with 1/<1/S> in hrss def'n. Use snr = E
         """
-        flow = int((sb.central_freq - sb.bandwidth/2.0 - psd.f0)/psd.deltaF)
-        fhigh = int((sb.central_freq + sb.bandwidth/2.0 - psd.f0)/psd.deltaF)
-        ndof = sb.duration*sb.bandwidth*2.
-        snr = (sb.snr+1.)*ndof
-        sb.amplitude = numpy.sqrt(  1./2. * snr / ( ( 1/psd.data[flow:fhigh]*psd.deltaF ).sum() / sb.bandwidth ) )
+        ndof = duration*bandwidth*2.
+        return new_compute_amplitude( (snr+1.)*ndof, bandwidth, inv_band )
+
+# output file -> (amplitude function, whether to store the root of the snr)
+AMPLITUDE_OUTPUTS = (
+        ('unc_new.xml.gz', new_compute_amplitude, False),
+        ('unc_E_new.xml.gz', tile_energy_E_new_compute_amplitude, False),
+        ('unc_E-d_new.xml.gz', tile_energy_Eminusd_new_compute_amplitude, False),
+        ('unc_root_new.xml.gz', new_compute_amplitude, True),
+        ('unc_root_E_new.xml.gz', tile_energy_E_new_compute_amplitude, True),
+        ('unc_root_E-d_new.xml.gz', tile_energy_Eminusd_new_compute_amplitude, True)
+)
+
+def compute_amplitudes( triggers, psd ):
+        """
+        Compute every amplitude variant in AMPLITUDE_OUTPUTS for all the triggers in triggers (a sngl_burst structured array, see eputils.read_table_array) at once. Returns a list of (output file, amplitudes, snrs) in the same order.
+        """
+        snr = triggers['snr'].astype(float)
+        central_freq = triggers['central_freq'].astype(float)
+        bandwidth = triggers['bandwidth'].astype(float)
+        duration = triggers['duration'].astype(float)
+        inv_band = band_inverse_psd( central_freq, bandwidth, psd )
+
+        results = []
+        for fname, amp_func, root_snr in AMPLITUDE_OUTPUTS:
+                if amp_func is new_compute_amplitude:
+                        amplitude = amp_func( snr, bandwidth, inv_band )
+                else:
+                        amplitude = amp_func( snr, bandwidth, duration, inv_band )
+                results.append( (fname, amplitude, numpy.sqrt(snr) if root_snr else snr) )
+        return results
+
+class OtherTablesContentHandler( ligolw.PartialLIGOLWContentHandler ):
+        """
+        Load every table of a document but the sngl_burst table, which is read as a structured array instead.
+        """
+        def __init__( self, document ):
+                super( OtherTablesContentHandler, self ).__init__( document, lambda name, attrs: name == ligolw.Table.tagName and not lsctables.SnglBurstTable.CheckProperties( name, attrs ) )
+lsctables.use_in( OtherTablesContentHandler )
+
+def load_other_tables( filename ):
+        """
+        Load the tables of filename other than sngl_burst (e.g. process and search_summary) into a new document, to be written along with each amplitude variant.
+        """
+        loaded = utils.load_filename( filename, contenthandler = OtherTablesContentHandler )
+        xmldoc = ligolw.Document()
+        root = xmldoc.appendChild( ligolw.LIGO_LW() )
+        for tbl in list(loaded.childNodes):
+                root.appendChild( loaded.removeChild(tbl) )
+        return xmldoc
+
+def write_amplitudes( triggers, psd, output_dir='.', xmldoc=None ):
+        """
+        Compute all of the amplitude variants for the triggers in triggers (a sngl_burst structured array), and write them as a sngl_burst table once per variant, into output_dir. The rows are streamed out with eputils.TableArrayStream, followed by the tables of xmldoc if given (see load_other_tables).
+        """
+        out = triggers.copy()
+        for fname, amplitude, snr in compute_amplitudes( triggers, psd ):
+                print 'writing %s...' % fname
+                out['amplitude'] = amplitude
+                out['snr'] = snr
+                stream = TableArrayStream( os.path.join(output_dir, fname), 'sngl_burst', out.dtype )
+                stream.write( out )
+                stream.close( xmldoc )
 
 #
 # =============================================================================
@@ -74,100 +149,24 @@ def tile_energy_Eminusd_new_compute_amplitude( sb, psd):
 # =============================================================================
 #
 
-from optparse import OptionParser
-optp = OptionParser()
-optp.add_option("--det-psd-file", action = 'store', type = 'string', help="Specify path to xml file containing psd. Required.")
-optp.add_option("--triggers", action='store', type = 'string', help="Specify path to xml file containing unclustered triggers. Required.")
+if __name__ == "__main__":
+        optp = OptionParser()
+        optp.add_option("--det-psd-file", action = 'store', type = 'string', default = 'L1_PSD_measured.xml.gz', help="Specify path to xml file containing psd. Default is L1_PSD_measured.xml.gz")
+        optp.add_option("--instrument", action = 'store', type = 'string', default = 'L1', help="Instrument of the psd to use. Default is L1")
+        optp.add_option("--triggers", action='store', type = 'string', default = 'unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz', help="Specify path to xml file containing unclustered triggers. Default is unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz")
+        optp.add_option("--output-dir", action='store', type = 'string', default = '.', help="Directory to write the output files to. Default is the current directory.")
 
-opts, args = optp.parse_args()
+        opts, args = optp.parse_args()
 
-# load psd 
-psdxml = utils.load_filename('L1_PSD_measured.xml.gz')
-measuredpsd = reference_psd.read_psd_xmldoc(psdxml)
-measuredpsd = measuredpsd['L1']
+        # load psd
+        psdxml = utils.load_filename(opts.det_psd_file)
+        measuredpsd = reference_psd.read_psd_xmldoc(psdxml)
+        measuredpsd = measuredpsd[opts.instrument]
 
-# load original unclustered triggers
-xmldoc = utils.load_filename('unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz')
-sngl_burst = table.get_table(xmldoc, lsctables.SnglBurstTable.tableName)
-num_rows = len(sngl_burst)
-#
-# =============================================================================
-#
-#                            Original clustering method
-#
-# =============================================================================
-#
+        # load original unclustered triggers, once
+        triggers = read_table_array(opts.triggers, 'sngl_burst')
+        others = load_other_tables(opts.triggers)
 
-# new
-print 'making new hrss files...'
-xmldoc = utils.load_filename('unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz')
-sngl_burst = table.get_table(xmldoc, lsctables.SnglBurstTable.tableName)
-for idx, row in enumerate(sngl_burst):
-	float(idx), float(num_rows)
-	sys.stdout.write( "\r Processing %d / %d " % (idx, num_rows)  )
-	new_compute_amplitude( row, measuredpsd)
-
-utils.write_filename(xmldoc, 'unc_new.xml.gz', gz = True)
-
-#tile energy E new
-print '\n making tile_energy_E new hrss files...'
-xmldoc = utils.load_filename('unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz')
-sngl_burst = table.get_table(xmldoc, lsctables.SnglBurstTable.tableName)
-for idx, row in enumerate(sngl_burst):
-	sys.stdout.write( "\r Processing %d / %d " % (idx, num_rows)  )
-	tile_energy_E_new_compute_amplitude( row, measuredpsd)
-
-utils.write_filename(xmldoc, 'unc_E_new.xml.gz', gz = True)
-
-# tile energy E-d new
-print '\n making tile_energy_E-d new hrss with root snr...'
-xmldoc = utils.load_filename('unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz')
-sngl_burst = table.get_table(xmldoc, lsctables.SnglBurstTable.tableName)
-for idx, row in enumerate(sngl_burst):
-	sys.stdout.write( "\r Processing %d / %d " % (idx, num_rows)  )
-        tile_energy_Eminusd_new_compute_amplitude( row, measuredpsd)
-
-utils.write_filename(xmldoc, 'unc_E-d_new.xml.gz', gz = True)
-
-#
-# =============================================================================
-#
-#                              New clustering method
-#
-# =============================================================================
-#
+        write_amplitudes( triggers, measuredpsd, opts.output_dir, others )
 
-# new 
-print '\n making new hrss with root snr...'
-xmldoc = utils.load_filename('unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz')
-sngl_burst = table.get_table(xmldoc, lsctables.SnglBurstTable.tableName)
-for idx, row in enumerate(sngl_burst):
-	sys.stdout.write( "\r Processing %d / %d " % (idx, num_rows)  )
-	new_compute_amplitude( row, measuredpsd)
-	row.snr = (row.snr)**.5
-
-utils.write_filename(xmldoc, 'unc_root_new.xml.gz', gz = True)
-
-# tile energy E new
-print '\n making tile_energy_E new hrss with root snr...'
-xmldoc = utils.load_filename('unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz')
-sngl_burst = table.get_table(xmldoc, lsctables.SnglBurstTable.tableName)
-for idx, row in enumerate(sngl_burst):
-	sys.stdout.write( "\r Processing %d / %d " % (idx, num_rows)  )
-        tile_energy_E_new_compute_amplitude( row, measuredpsd)
-        row.snr = (row.snr)**.5
-
-utils.write_filename(xmldoc, 'unc_root_E_new.xml.gz', gz = True)
-
-# tile energy E-d new
-print '\n making tile_energy_E-d new hrss with root snr...'
-xmldoc = utils.load_filename('unclustered_results/L1-FAKE_STRAIN_Triggers.xml.gz')
-sngl_burst = table.get_table(xmldoc, lsctables.SnglBurstTable.tableName)
-for idx, row in enumerate(sngl_burst):
-	sys.stdout.write( "\r Processing %d / %d " % (idx, num_rows)  )
-        tile_energy_Eminusd_new_compute_amplitude( row, measuredpsd)
-	row.snr = (row.snr)**.5
-
-utils.write_filename(xmldoc, 'unc_root_E-d_new.xml.gz', gz = True)
-
-print 'done.'
+        print 'done.'
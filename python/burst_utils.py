@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 import sys
+import os
 import math
+import hashlib
+import tempfile
+from collections import defaultdict, OrderedDict
 import lal, lalsimulation, lalburst
 
 import numpy
@@ -40,6 +44,386 @@ LAL_DETECTORS = dict(zip(
     [lal.CachedDetectors[d] for d in [getattr(lal, name) for name in dir(lal) if name.endswith("DETECTOR")]]
 ))
 
+def waveform_sampling_rate(sim):
+    """
+    Choose a (power of two) sampling rate in Hz appropriate for the band of the waveform described by sim.
+    """
+    # FIXME: This is overkill for BTLWNB, and won't work entirely for 
+    # cosmic strings
+    sampling_rate = 4*(sim.frequency + (sim.bandwidth or 0))
+    return 2**(int(math.log(sampling_rate, 2)+1))
+
+def antenna_response(detectors, ra, dec, psi, gmst):
+    """
+    Compute the antenna patterns for a list of detectors (prefixes in LAL_DETECTORS) and a set of sources with sky location (ra, dec), polarization angle psi, and Greenwich mean sidereal time gmst, all in radians. The source arguments can be scalars or arrays of length N. Returns (F+, Fx), each with shape (N, len(detectors)). This is the calculation done by XLALComputeDetAMResponse, but done over all sources and detectors at once.
+    """
+    resp = numpy.array([LAL_DETECTORS[d].response for d in detectors], dtype=float)
+    ra, dec, psi, gmst = numpy.broadcast_arrays(*[numpy.atleast_1d(numpy.asarray(a, dtype=float)) for a in (ra, dec, psi, gmst)])
+
+    gha = gmst - ra
+    cosgha, singha = numpy.cos(gha), numpy.sin(gha)
+    cosdec, sindec = numpy.cos(dec), numpy.sin(dec)
+    cospsi, sinpsi = numpy.cos(psi), numpy.sin(psi)
+
+    x = numpy.array([-cospsi * singha - sinpsi * cosgha * sindec,
+                     -cospsi * cosgha + sinpsi * singha * sindec,
+                     sinpsi * cosdec]).T
+    y = numpy.array([sinpsi * singha - cospsi * cosgha * sindec,
+                     sinpsi * cosgha + cospsi * singha * sindec,
+                     cospsi * cosdec]).T
+
+    fplus = numpy.einsum("dij,ni,nj->nd", resp, x, x) - numpy.einsum("dij,ni,nj->nd", resp, y, y)
+    fcross = numpy.einsum("dij,ni,nj->nd", resp, x, y) + numpy.einsum("dij,ni,nj->nd", resp, y, x)
+    return fplus, fcross
+
+def arrival_time_delays(detectors, ra, dec, gmst):
+    """
+    Compute the arrival time (in seconds, relative to the geocenter) in a list of detectors (prefixes in LAL_DETECTORS) of signals from sky locations (ra, dec) at Greenwich mean sidereal time gmst, all in radians. The source arguments can be scalars or arrays of length N. Returns an array with shape (N, len(detectors)). This is the calculation done by XLALTimeDelayFromEarthCenter, but done over all sources and detectors at once.
+    """
+    loc = numpy.array([LAL_DETECTORS[d].location for d in detectors], dtype=float)
+    ra, dec, gmst = numpy.broadcast_arrays(*[numpy.atleast_1d(numpy.asarray(a, dtype=float)) for a in (ra, dec, gmst)])
+
+    gha = gmst - ra
+    ehat = numpy.array([numpy.cos(dec) * numpy.cos(gha),
+                        -numpy.cos(dec) * numpy.sin(gha),
+                        numpy.sin(dec)]).T
+    return -numpy.dot(ehat, loc.T) / lal.C_SI
+
+def _zero_pad(out, data):
+    """
+    Copy data into out, zero padding the end if data is short, or keeping only the last len(out) samples if it is long. This matches the resizing done in SimBurstWaveform.frequency_series.
+    """
+    n = min(len(out), len(data))
+    out[:n] = data[len(data)-n:]
+    out[n:] = 0
+
+# Coarsest frequency resolution (Hz) allowed for adaptive transform lengths,
+# so that the PSD is still resolved across the band of a short burst
+ADAPTIVE_MAX_DELTAF = 1.0
+
+def adaptive_fft_length(nsamples, sampling_rate, max_deltaF=ADAPTIVE_MAX_DELTAF):
+    """
+    Choose the smallest power of two transform length which holds nsamples samples of a waveform sampled at sampling_rate (Hz) and gives a frequency resolution no coarser than max_deltaF (Hz).
+    """
+    length = max(nsamples, int(math.ceil(sampling_rate/max_deltaF)), 1)
+    return 2**int(math.ceil(math.log(length, 2)))
+
+def interpolate_psd(psd, deltaF, new_deltaF, nbins):
+    """
+    Linearly interpolate psd, sampled at deltaF (Hz) starting from f = 0, onto nbins frequency bins spaced by new_deltaF. Bins beyond the end of psd are set to infinity, so they drop out of any noise weighted sum.
+    """
+    psd = numpy.asarray(psd, dtype=float)
+    return numpy.interp(numpy.arange(nbins)*new_deltaF, numpy.arange(len(psd))*deltaF, psd, right=numpy.inf)
+
+#
+# PSD grids, computed once and stored on disk
+#
+
+def read_psd_file(filename):
+    """
+    Read a PSD from filename, either a LIGO_LW XML document with a REAL8FrequencySeries or a two column (frequency, PSD) text file. Returns the (frequencies, PSD) arrays.
+    """
+    try:
+        from glue.ligolw import utils
+        from pylal.series import read_psd_xmldoc, LIGOLWContentHandler
+        xmldoc = utils.load_filename(filename, contenthandler=LIGOLWContentHandler)
+        psd = read_psd_xmldoc(xmldoc).values()[0]
+        f = numpy.arange(len(psd.data))*psd.deltaF + psd.f0
+        return f, numpy.asarray(psd.data)
+    except:
+        f, psd = numpy.loadtxt(filename, unpack=True)
+        return f, psd
+
+def _evaluate_psd(spec, f):
+    """
+    Evaluate the PSD spec (see psd_grid) at the uniformly spaced frequencies f, starting from f = 0.
+    """
+    if os.path.isfile(spec):
+        fpsd, psd = read_psd_file(spec)
+        return numpy.interp(f, fpsd, psd)
+
+    try:
+        psdfunc = getattr(lalsimulation, spec)
+    except AttributeError:
+        raise AttributeError("Could not find PSD function %s in lalsimulation" % spec)
+
+    # Fill the whole series in one call through the function pointer, if
+    # the bindings provide one, rather than one call per frequency bin
+    psdptr = getattr(lalsimulation, spec + "Ptr", None)
+    if psdptr is None or len(f) < 2:
+        return numpy.array(map(psdfunc, f))
+    series = lal.CreateREAL8FrequencySeries(
+        name = spec,
+        epoch = lal.LIGOTimeGPS(0),
+        f0 = 0,
+        deltaF = f[1] - f[0],
+        sampleUnits = lal.DimensionlessUnit,
+        length = len(f)
+    )
+    lalsimulation.SimNoisePSD(series, 0.0, psdptr)
+    return numpy.array(series.data.data)
+
+def psd_grid(spec, deltaF, fmax, cache_dir=None, fix_dc=False):
+    """
+    Get the PSD described by spec, which is either the name of a PSD function in lalsimulation (e.g. SimNoisePSDaLIGOZeroDetHighPower) or the path to a PSD file (see read_psd_file), sampled at f = 0, deltaF, ..., fmax. If fix_dc is True, the DC bin, which often comes out as nan, is set to the value of the next bin.
+
+    If cache_dir is given, the grid is stored there as a .npy file named for the PSD function (or the SHA1 of the file contents), deltaF, fmax, and fix_dc, and later calls memory map that file read-only instead of evaluating the PSD again. The file is written to a temporary name and then renamed, so that concurrent jobs sharing the directory never see a partial grid. The returned array must not be modified.
+    """
+    nbins = int(round(fmax/deltaF)) + 1
+    f = numpy.arange(nbins)*deltaF
+
+    if cache_dir is not None:
+        if os.path.isfile(spec):
+            with open(spec, "rb") as psdfile:
+                key = hashlib.sha1(psdfile.read()).hexdigest()
+        else:
+            key = spec
+        fname = os.path.join(cache_dir, "%s-%.17g-%.17g%s.npy" % (key, deltaF, fmax, "-dc" if fix_dc else ""))
+        if os.path.exists(fname):
+            return numpy.load(fname, mmap_mode="r")
+
+    psd = _evaluate_psd(spec, f)
+    if fix_dc and len(psd) > 1:
+        psd[0] = psd[1]
+
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Made by someone else in the meantime
+                pass
+        fd, tmpname = tempfile.mkstemp(suffix=".npy", dir=cache_dir)
+        with os.fdopen(fd, "wb") as tmpfile:
+            numpy.save(tmpfile, psd)
+        os.rename(tmpname, fname)
+        return numpy.load(fname, mmap_mode="r")
+
+    return psd
+
+#
+# FFT plans and buffers, shared by every waveform in the process
+#
+
+# Number of transform lengths for which plans and buffers are kept
+FFT_CACHE_SIZE = 8
+_FFT_WORKSPACES = OrderedDict()
+
+class FFTWorkspace(object):
+    """
+    A forward REAL8 FFT plan for a fixed transform length, along with a time series and frequency series of that size which are reused by every transform.
+    """
+    def __init__(self, length):
+        self.length = length
+        self.plan = lal.CreateForwardREAL8FFTPlan(length, 1)
+        self.tseries = lal.CreateREAL8TimeSeries(
+            name = "TD signal",
+            epoch = lal.LIGOTimeGPS(0),
+            f0 = 0,
+            deltaT = 1.0,
+            sampleUnits = lal.DimensionlessUnit,
+            length = length
+        )
+        self.fseries = lal.CreateCOMPLEX16FrequencySeries(
+            name = "FD signal",
+            epoch = lal.LIGOTimeGPS(0),
+            f0 = 0,
+            deltaF = 1.0/length,
+            sampleUnits = lal.DimensionlessUnit,
+            length = length/2 + 1
+        )
+        self._padded = numpy.zeros(length)
+
+    def transform(self, data, deltaT, epoch, out=None):
+        """
+        Fourier transform the samples in data (sampled at deltaT, starting at epoch) after zero padding them to the workspace length, or keeping only the last samples if there are too many. The result is written to out if given (a COMPLEX16FrequencySeries of length/2 + 1 samples), otherwise to the workspace frequency series, which is overwritten by the next transform.
+        """
+        _zero_pad(self._padded, data)
+        self.tseries.data.data = self._padded
+        self.tseries.deltaT = deltaT
+        self.tseries.epoch = epoch
+        if len(data) > self.length:
+            self.tseries.epoch += (len(data) - self.length) * deltaT
+
+        if out is None:
+            out = self.fseries
+        lal.REAL8TimeFreqFFT(out, self.tseries, self.plan)
+        return out
+
+def get_fft_workspace(length):
+    """
+    Get the FFTWorkspace for a given transform length, creating it if necessary. The FFT_CACHE_SIZE most recently used workspaces are retained.
+    """
+    try:
+        workspace = _FFT_WORKSPACES.pop(length)
+    except KeyError:
+        workspace = FFTWorkspace(length)
+    _FFT_WORKSPACES[length] = workspace
+    while len(_FFT_WORKSPACES) > FFT_CACHE_SIZE:
+        _FFT_WORKSPACES.popitem(last=False)
+    return workspace
+
+#
+# Closed form SineGaussian quantities
+#
+
+# Terms kept in the Fourier series of |sin x| used for the h+hx overlap
+SG_SERIES_TERMS = 8
+
+def use_sine_gaussian_analytic(sim):
+    """
+    Whether the analytic SineGaussian expressions apply to sim, rather than generating the waveform.
+    """
+    return sim.waveform == "SineGaussian" and (sim.q or 0) > 0 and (sim.frequency or 0) > 0
+
+def _sine_gaussian_params(sim):
+    """
+    Get the decay time, the peak amplitudes of h+ and hx, and the phase for a SineGaussian, following the conventions of XLALSimBurstSineGaussian, which is passed pol_ellipse_angle as the phase of the oscillations:
+
+    h+(t) = h0+ exp(-t^2/tau^2) cos(2 pi f0 t - phase), hx(t) = h0x exp(-t^2/tau^2) sin(2 pi f0 t - phase)
+
+    with tau = Q / (sqrt(2) pi f0).
+    """
+    q, f0, hrss = sim.q, sim.frequency, sim.hrss or 0
+    e, phase = sim.pol_ellipse_e or 0, sim.pol_ellipse_angle or 0
+    tau = q / (math.sqrt(2) * math.pi * f0)
+
+    # semimajor and semiminor axes of the polarization ellipse, which set the
+    # rss of each polarization
+    a = 1.0 / math.sqrt(2.0 - e**2)
+    b = a * math.sqrt(1.0 - e**2)
+
+    # rss of unit amplitude cosine- and sine-gaussians with this phase
+    cgrss = math.sqrt(q / (4.0 * f0 * math.sqrt(math.pi)) * (1.0 + math.cos(2 * phase) * math.exp(-q**2)))
+    sgrss = math.sqrt(q / (4.0 * f0 * math.sqrt(math.pi)) * (1.0 - math.cos(2 * phase) * math.exp(-q**2)))
+    return tau, hrss * a / cgrss, hrss * b / sgrss, phase
+
+def sine_gaussian_hrss(sim):
+    """
+    Calculate the hrss components (hrss, h+^2, hx^2, hphx) of the SineGaussian described by sim in closed form. These are the same quantities as ligolw_binj.measure_hrss, where hphx is the integral of |h+||hx|, which uses the Fourier series of |sin(x)| and converges quickly in Q.
+    """
+    tau, h0plus, h0cross, phase = _sine_gaussian_params(sim)
+    q = sim.q
+    hphp = h0plus**2 * tau * math.sqrt(math.pi / 8.0) * (1.0 + math.cos(2 * phase) * math.exp(-q**2))
+    hxhx = h0cross**2 * tau * math.sqrt(math.pi / 8.0) * (1.0 - math.cos(2 * phase) * math.exp(-q**2))
+
+    # |cos(x) sin(x)| = |sin(2x)|/2 and
+    # |sin(y)| = 2/pi - 4/pi sum_k cos(2ky) / (4k^2 - 1)
+    series = sum(math.cos(4 * k * phase) * math.exp(-4 * k**2 * q**2) / (4 * k**2 - 1) for k in range(1, SG_SERIES_TERMS+1))
+    hphx = abs(h0plus * h0cross) * 0.5 * tau * math.sqrt(math.pi / 2.0) * (2.0 / math.pi - 4.0 / math.pi * series)
+    return math.sqrt(hphp + hxhx), hphp, hxhx, hphx
+
+def sine_gaussian_spectrum(sim, f):
+    """
+    Calculate the Fourier transforms (H+(f), Hx(f)) of the SineGaussian described by sim at frequencies f (Hz), with the peak of the waveform at t = 0. With a phase (pol_ellipse_angle) of zero, H+ is real and Hx is imaginary, so the h+hx cross term in any noise weighted inner product vanishes.
+    """
+    tau, h0plus, h0cross, phase = _sine_gaussian_params(sim)
+    f = numpy.asarray(f, dtype=float)
+    norm = 0.5 * tau * math.sqrt(math.pi)
+    lower = numpy.exp(-(math.pi * tau * (f - sim.frequency))**2) * numpy.exp(-1j * phase)
+    upper = numpy.exp(-(math.pi * tau * (f + sim.frequency))**2) * numpy.exp(1j * phase)
+    return h0plus * norm * (lower + upper), -1j * h0cross * norm * (lower - upper)
+
+#
+# h+ and hx for SimBurst rows, generated once per process
+#
+
+# Default limit (in bytes) on the h+ and hx samples held by a WaveformCache
+WAVEFORM_CACHE_BYTES = 256 * 1024**2
+
+# SimBurst columns which determine the h+ and hx generated by lalburst. The sky
+# location and polarization angle are only applied later, and the peak time
+# only shifts the epoch.
+WAVEFORM_KEY_ATTRS = ("waveform", "frequency", "q", "duration", "bandwidth", "pol_ellipse_e", "pol_ellipse_angle", "hrss", "amplitude", "egw_over_rsquared", "waveform_number")
+
+# The columns which lalburst actually reads for the families it knows, so that
+# filling in a column it ignores (e.g. the measured hrss of a BTLWNB, which is
+# generated from its energy) does not generate the waveform again
+WAVEFORM_FAMILY_KEY_ATTRS = {
+    "BTLWNB": ("waveform", "frequency", "duration", "bandwidth", "pol_ellipse_e", "pol_ellipse_angle", "egw_over_rsquared", "waveform_number"),
+    "StringCusp": ("waveform", "frequency", "amplitude"),
+    "SineGaussian": ("waveform", "frequency", "q", "pol_ellipse_e", "pol_ellipse_angle", "hrss"),
+}
+
+def _as_swig_sim_burst(sim):
+    """
+    Return sim as a SWIG wrapped lalburst.SimBurst, converting it with copy_sim_burst if it is a lsctables.SimBurst.
+    """
+    if isinstance(sim, lsctables.SimBurst):
+        return copy_sim_burst(sim)
+    return sim
+
+def _geocent_time(sim):
+    """
+    Get the geocentric peak time of sim (either a lsctables.SimBurst or a SWIG wrapped lalburst.SimBurst) as a lal.LIGOTimeGPS.
+    """
+    if isinstance(sim, lsctables.SimBurst):
+        return lal.LIGOTimeGPS(sim.time_geocent_gps, sim.time_geocent_gps_ns)
+    return sim.time_geocent_gps
+
+class WaveformCache(object):
+    """
+    A least recently used cache of the h+ and hx generated by lalburst.GenerateSimBurst, keyed by the sampling rate and the columns of WAVEFORM_FAMILY_KEY_ATTRS for the waveform family (WAVEFORM_KEY_ATTRS for other families). The samples of the cached polarizations are held in read-only arrays, and the oldest entries are dropped once they take up more than max_bytes. converter turns a row into the SWIG wrapped lalburst.SimBurst passed to lalburst (by default, rows which are already SWIG wrapped are used as is, and lsctables.SimBurst rows are converted with copy_sim_burst).
+    """
+    def __init__(self, max_bytes=WAVEFORM_CACHE_BYTES, converter=_as_swig_sim_burst):
+        self.max_bytes = max_bytes
+        self.converter = converter
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+        self._cache = OrderedDict()
+
+    def key(self, sim, sampling_rate):
+        attrs = WAVEFORM_FAMILY_KEY_ATTRS.get(getattr(sim, "waveform", None), WAVEFORM_KEY_ATTRS)
+        return tuple(getattr(sim, attr, None) or 0 for attr in attrs) + (float(sampling_rate),)
+
+    def polarizations(self, sim, sampling_rate):
+        """
+        Get the polarizations of the waveform described by sim at sampling_rate (Hz), generating them if they are not cached. Returns (hp, hx, deltaT, offset), where hp and hx are read-only arrays of samples and offset is the time (in seconds) of the first sample relative to the geocentric peak time of sim. The arrays are shared with every other caller, so copy them before making any changes.
+        """
+        key = self.key(sim, sampling_rate)
+        try:
+            entry = self._cache.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            swig_sim = self.converter(sim)
+            hp, hx = lalburst.GenerateSimBurst(swig_sim, 1.0/sampling_rate)
+            hp_data, hx_data = numpy.array(hp.data.data), numpy.array(hx.data.data)
+            hp_data.flags.writeable = False
+            hx_data.flags.writeable = False
+            entry = (hp_data, hx_data, hp.deltaT, float(hp.epoch - swig_sim.time_geocent_gps))
+            self.nbytes += hp_data.nbytes + hx_data.nbytes
+
+        self._cache[key] = entry
+        # The newest entry is always kept, even if it alone is over the limit
+        while self.nbytes > self.max_bytes and len(self._cache) > 1:
+            _, (hp_old, hx_old, _, _) = self._cache.popitem(last=False)
+            self.nbytes -= hp_old.nbytes + hx_old.nbytes
+        return entry
+
+    def time_series(self, sim, sampling_rate):
+        """
+        Get the polarizations of the waveform described by sim at sampling_rate (Hz) as a new pair of REAL8TimeSeries (h+, hx), as returned by lalburst.GenerateSimBurst. Only the generation is cached, so the series can be modified freely.
+        """
+        hp_data, hx_data, deltaT, offset = self.polarizations(sim, sampling_rate)
+        epoch = _geocent_time(sim) + offset
+        series = []
+        for name, data in (("hplus", hp_data), ("hcross", hx_data)):
+            h = lal.CreateREAL8TimeSeries(
+                name = name,
+                epoch = epoch,
+                f0 = 0,
+                deltaT = deltaT,
+                sampleUnits = lal.StrainUnit,
+                length = len(data)
+            )
+            h.data.data = data
+            series.append(h)
+        return tuple(series)
+
+# Shared by everything in this process which generates SimBurst waveforms
+waveform_cache = WaveformCache()
+
 class SimBurstWaveform(lsctables.SimBurst):
 
     @classmethod
@@ -51,17 +435,12 @@ class SimBurstWaveform(lsctables.SimBurst):
             setattr(sbw, attr, getattr(sim_burst, attr))
         return sbw
 
-    def __init__(self, *args, **kwargs):
-        super(SimBurstWaveform, self).__init__(*args, **kwargs)
-        self._fwdlen = 0
-        self._fwdplan = None
-
     def time_series(self, sampling_rate, detector=None):
         """
         Generate a time series at a given sampling_rate (Hz) for the waveform using a call to lalsimulation. If detector is None (default), return only the (h+, hx) tuple. Otherwise, apply the proper detector anntenna patterns and return the resultant series F+h+ + Fxhx.
         """
 
-        hp, hx = lalburst.GenerateSimBurst(copy_sim_burst(self), 1.0/sampling_rate)
+        hp, hx = waveform_cache.time_series(self, sampling_rate)
 
         if detector is None:
             return hp, hx
@@ -69,62 +448,50 @@ class SimBurstWaveform(lsctables.SimBurst):
         detector = LAL_DETECTORS[detector]
         return lalsimulation.SimDetectorStrainREAL8TimeSeries(hp, hx, self.ra, self.dec, self.psi, detector)
 
-    def __get_fwdplan(self, sampling_rate, deltaF):
-        fwdlen = int(sampling_rate/deltaF)
-        if self._fwdplan is None or fwdlen != self._fwdlen:
-            self._fwdplan = lal.CreateForwardREAL8FFTPlan(fwdlen, 1)
-            self._fwdlen = int(sampling_rate/deltaF)
-
-    def frequency_series(self, deltaF, detector=None, fwdplan=None):
+    def frequency_series(self, deltaF, detector=None, fwdplan=None, reuse_buffer=False, adaptive=False):
         """
-        Generate a frequency series at a given frequency bin spacing deltaF (Hz) for the waveform using a call to lalsimulation. The function time_series is called first to generate the waveform in the time domain. If detector is None (default), return only hf with no antenna patterns applied. Otherwise, apply the proper detector anntenna patterns and return the resultant series hf = FFT[F+h+ + Fxhx].
+        Generate a frequency series at a given frequency bin spacing deltaF (Hz) for the waveform using a call to lalsimulation. The function time_series is called first to generate the waveform in the time domain. If detector is None (default), return only hf with no antenna patterns applied. Otherwise, apply the proper detector anntenna patterns and return the resultant series hf = FFT[F+h+ + Fxhx]. The FFT plan and buffers are shared across the process (see get_fft_workspace). If reuse_buffer is True, the shared output buffer is returned rather than a new series, and it will be overwritten by the next transform of the same length. If adaptive is True, deltaF is ignored and the transform length is instead the smallest power of two which holds the waveform (see adaptive_fft_length), so the deltaF of the result should be checked by the caller.
         """
 
-        # FIXME: This is overkill for BTLWNB, and won't work entirely for 
-        # cosmic strings
-        sampling_rate = 4*(self.frequency + self.bandwidth or 0)
-        sampling_rate = 2**(int(math.log(sampling_rate, 2)+1))
-        self.__get_fwdplan(sampling_rate, deltaF)
+        sampling_rate = waveform_sampling_rate(self)
 
         if detector is not None:
             h = self.time_series(sampling_rate, detector)
+            data, deltaT, epoch = h.data.data, h.deltaT, h.epoch
         else:
             hp, hx = self.time_series(sampling_rate, detector)
-            h = lal.CreateREAL8TimeSeries(
-                name = "TD signal",
-                epoch = hp.epoch,
+            data, deltaT, epoch = hp.data.data + hx.data.data, hp.deltaT, hp.epoch
+
+        if adaptive:
+            length = adaptive_fft_length(len(data), sampling_rate)
+        else:
+            length = int(sampling_rate/deltaF)
+        workspace = get_fft_workspace(length)
+        out = None
+        if not reuse_buffer:
+            out = lal.CreateCOMPLEX16FrequencySeries(
+                name = "FD signal",
+                epoch = epoch,
                 f0 = 0,
-                deltaT = hp.deltaT,
+                deltaF = float(sampling_rate)/length,
                 sampleUnits = lal.DimensionlessUnit,
-                length = hp.data.length
+                length = workspace.length/2 + 1
             )
-            h.data.data = hp.data.data + hx.data.data
- 
-        # zero pad
-        needed_samps = int(sampling_rate/deltaF)
-        prevlen = h.data.length
-        if h.data.length < needed_samps:
-            h = lal.ResizeREAL8TimeSeries(h, 0, needed_samps)
-        elif h.data.length > needed_samps:
-            h = lal.ResizeREAL8TimeSeries(h, h.data.length-needed_samps, needed_samps)
-
-        # adjust heterodyne frequency to match flow
-        hf = lal.CreateCOMPLEX16FrequencySeries(
-            name = "FD signal",
-            epoch = h.epoch,
-            f0 = 0,
-            deltaF = deltaF,
-            sampleUnits = lal.DimensionlessUnit,
-            length = int(h.data.length/2 + 1)
-        )
 
         # Forward FFT
-        lal.REAL8TimeFreqFFT(hf, h, self._fwdplan)
-        return hf
+        return workspace.transform(data, deltaT, epoch, out)
 
-    def snr(self, psd=None, deltaF=0.125, detector=None):
+    def snr(self, psd=None, deltaF=0.125, detector=None, adaptive=False, analytic=True):
+        """
+        Calculate the optimal SNR of the waveform in a detector with a given psd, sampled at deltaF from f = 0. If adaptive is True, the waveform is transformed with the shortest adequate length (see frequency_series) and the psd is interpolated onto the resulting frequency bins. If analytic is True (default), SineGaussians skip the waveform generation and FFT, and their spectrum is evaluated in closed form on the bins of the psd instead (see sine_gaussian_spectrum).
+        """
 
-        hf = self.frequency_series(deltaF, detector)
+        if analytic and psd is not None and use_sine_gaussian_analytic(self):
+            return self._sine_gaussian_snr(psd, deltaF, detector)
+
+        hf = self.frequency_series(deltaF, detector, reuse_buffer=True, adaptive=adaptive)
+        if adaptive and psd is not None:
+            psd = interpolate_psd(psd, deltaF, hf.deltaF, len(hf.data.data))
 
         # Assumed same deltaF and f0 = 0
         idx_lower, idx_upper = 0, min(len(hf.data.data), len(psd))
@@ -133,11 +500,109 @@ class SimBurstWaveform(lsctables.SimBurst):
         if psd is None:
             return numpy.sqrt(hrss.sum()*hf.deltaF)
 
-        # divide and sum for SNR
-        nw_ip = numpy.nan_to_num(hrss / psd[idx_lower:idx_upper])
-        power = 4 * numpy.real(sum(nw_ip)) * hf.deltaF
+        # divide and sum for SNR, leaving out bins where the PSD is zero or
+        # not finite
+        psd = numpy.asarray(psd[idx_lower:idx_upper], dtype=float)
+        valid = numpy.isfinite(psd) & (psd > 0)
+        power = 4 * numpy.real(numpy.sum(hrss[valid] / psd[valid])) * hf.deltaF
         return numpy.sqrt(power)
 
+    def _sine_gaussian_snr(self, psd, deltaF, detector=None):
+        # Same band as the numerical calculation: up to the Nyquist frequency
+        # of waveform_sampling_rate
+        nbins = min(int(waveform_sampling_rate(self)/deltaF)/2 + 1, len(psd))
+        hp_f, hx_f = sine_gaussian_spectrum(self, numpy.arange(nbins)*deltaF)
+
+        if detector is None:
+            fplus, fcross = 1.0, 1.0
+        else:
+            gmst = lal.GreenwichMeanSiderealTime(lal.LIGOTimeGPS(self.time_geocent_gps, self.time_geocent_gps_ns))
+            fplus, fcross = antenna_response([detector], self.ra, self.dec, self.psi, gmst)
+            fplus, fcross = fplus[0,0], fcross[0,0]
+
+        hsq = numpy.abs(fplus * hp_f + fcross * hx_f)**2
+        psd = numpy.asarray(psd[:nbins], dtype=float)
+        valid = numpy.isfinite(psd) & (psd > 0)
+        return numpy.sqrt(4 * numpy.sum(hsq[valid] / psd[valid]) * deltaF)
+
+# Default limit (in bytes) on the spectra and time series held at once by
+# sim_burst_snr_batch
+SNR_BATCH_BYTES = 64 * 1024**2
+
+def sim_burst_snr_batch(sim_bursts, psds, deltaF=0.125, detectors=None, max_bytes=SNR_BATCH_BYTES, analytic=True):
+    """
+    Compute the optimal SNR of every injection in sim_bursts (an iterable of lsctables.SimBurst rows, e.g. a SimBurstTable) in a set of detectors. psds is a dictionary of detector prefix -> PSD array, sampled at deltaF starting from f = 0. Returns an array of shape (len(sim_bursts), len(detectors)), with the columns ordered as detectors (default is sorted(psds.keys())).
+
+    The h+ and hx polarizations are generated once per injection. Since |F+ h+ + Fx hx|^2 expands into <h+|h+>, <hx|hx>, and Re<h+|hx>, these inner products are computed for every detector PSD as stacked matrix products and the antenna patterns are applied afterwards as a projection. Injections are grouped by waveform_sampling_rate, and each group is transformed with stacked FFTs in chunks of as many injections as fit in about max_bytes, so memory use does not grow with the sampling rate or the frequency resolution. If analytic is True (default), the spectra of SineGaussians are instead evaluated in closed form (see sine_gaussian_spectrum), and they are never generated. PSD bins which are zero or not finite are excluded from the sums.
+    """
+    sim_bursts = list(sim_bursts)
+    detectors = list(detectors or sorted(psds.keys()))
+    snrs = numpy.zeros((len(sim_bursts), len(detectors)))
+    if len(sim_bursts) == 0:
+        return snrs
+
+    gmst = [lal.GreenwichMeanSiderealTime(lal.LIGOTimeGPS(sim.time_geocent_gps, sim.time_geocent_gps_ns)) for sim in sim_bursts]
+    fplus, fcross = antenna_response(detectors,
+        [sim.ra for sim in sim_bursts],
+        [sim.dec for sim in sim_bursts],
+        [sim.psi for sim in sim_bursts],
+        gmst)
+
+    by_rate = defaultdict(list)
+    for i, sim in enumerate(sim_bursts):
+        by_rate[waveform_sampling_rate(sim)].append(i)
+
+    for sampling_rate, idx in by_rate.iteritems():
+        nsamps = int(sampling_rate/deltaF)
+        nbins = nsamps/2 + 1
+
+        # Noise weighting 4 deltaF / S(f), one column per detector
+        weights = numpy.zeros((nbins, len(detectors)))
+        for j, det in enumerate(detectors):
+            psd = numpy.asarray(psds[det], dtype=float)[:nbins]
+            valid = numpy.isfinite(psd) & (psd > 0)
+            weights[:len(psd),j][valid] = 4 * deltaF / psd[valid]
+
+        # Two complex spectra, two real time series and the temporaries of
+        # the inner products for each injection
+        row_bytes = 2 * 16 * nbins + 2 * 8 * nsamps + 2 * 16 * nbins
+        chunk_size = max(1, max_bytes // row_bytes)
+        for start in range(0, len(idx), chunk_size):
+            chunk = idx[start:start+chunk_size]
+            hp_f = numpy.zeros((len(chunk), nbins), dtype=numpy.complex128)
+            hx_f = numpy.zeros((len(chunk), nbins), dtype=numpy.complex128)
+
+            numerical = []
+            for k, i in enumerate(chunk):
+                if analytic and use_sine_gaussian_analytic(sim_bursts[i]):
+                    hp_f[k], hx_f[k] = sine_gaussian_spectrum(sim_bursts[i], numpy.arange(nbins)*deltaF)
+                else:
+                    numerical.append(k)
+
+            if numerical:
+                hp_t = numpy.zeros((len(numerical), nsamps))
+                hx_t = numpy.zeros((len(numerical), nsamps))
+                for n, k in enumerate(numerical):
+                    hp, hx, _, _ = waveform_cache.polarizations(sim_bursts[chunk[k]], sampling_rate)
+                    _zero_pad(hp_t[n], hp)
+                    _zero_pad(hx_t[n], hx)
+
+                # Same normalization as REAL8TimeFreqFFT
+                hp_f[numerical] = numpy.fft.rfft(hp_t, axis=1) / sampling_rate
+                hx_f[numerical] = numpy.fft.rfft(hx_t, axis=1) / sampling_rate
+                del hp_t, hx_t
+
+            pp = numpy.dot(numpy.abs(hp_f)**2, weights)
+            xx = numpy.dot(numpy.abs(hx_f)**2, weights)
+            px = numpy.dot(numpy.real(hp_f.conj() * hx_f), weights)
+            del hp_f, hx_f
+
+            fp, fx = fplus[chunk], fcross[chunk]
+            power = fp**2 * pp + fx**2 * xx + 2 * fp * fx * px
+            snrs[chunk] = numpy.sqrt(numpy.clip(power, 0, None))
+
+    return snrs
+
 def read_snrs(fname):
     snrs = {}
     with open(fname) as fin:
@@ -157,9 +622,9 @@ if __name__ == "__main__":
     sbt = lsctables.SimBurstTable.get_table(xmldoc)
 
     deltaF, fmax = 0.125, 4096.0
-    psd_len = fmax/deltaF
-    psd = map(lalsimulation.SimNoisePSDaLIGOZeroDetHighPower, 
-        numpy.linspace(0, psd_len, psd_len+1)*deltaF)
+    # Optional second argument: directory in which to keep the PSD grid
+    psd_cache_dir = len(sys.argv) > 2 and sys.argv[2] or None
+    psd = psd_grid("SimNoisePSDaLIGOZeroDetHighPower", deltaF, fmax, psd_cache_dir)
 
     ifos = ("H1", "L1", "V1")
 
@@ -170,10 +635,10 @@ if __name__ == "__main__":
         print >>fout, "# deltaF %e flow %e fhigh %e" % (deltaF, 0.0, fmax)
         print >>fout, "# simulation_id H1 L1 V1"
 
-        for sim in sbt:
-            sbw = SimBurstWaveform.from_SimBurst(sim)
+        snrs = sim_burst_snr_batch(sbt, dict((ifo, psd) for ifo in ifos), deltaF, ifos)
+        for sim, sim_snrs in zip(sbt, snrs):
             fout.write(str(sim.simulation_id) + " ")
-            print >>fout, " ".join("%e" % sbw.snr(psd, detector = ifo) for ifo in ifos)
+            print >>fout, " ".join("%e" % snr for snr in sim_snrs)
 
     #snrs = read_snrs("H1L1V1_snrs.txt")
     #print snrs.values()
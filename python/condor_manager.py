@@ -1,17 +1,30 @@
 import sys
 import os
-import glob
+import atexit
 import stat
+import math
 import itertools
 from collections import OrderedDict
 import subprocess
 import shlex
+import json
+import tempfile
+import errno
+import time
+import sqlite3
+from multiprocessing.pool import ThreadPool
+import re
+import glob
+import hashlib
+from StringIO import StringIO
 from xml.etree import ElementTree
 from ConfigParser import ConfigParser
 
 from glue.pipeline import CondorJob, CondorDAGJob, CondorDAGNode, CondorDAG
 from glue.segments import segment, segmentlist, segmentlistdict
-from glue.lal import Cache
+from glue.lal import Cache, CacheEntry
+
+from trigger_files import TriggerFileFinder, expand_output_dir, trigger_file_segment
 
 ONLINE_INCANTATION = {"+Online_Burst_ExcessPower": "True",
     "Requirements": "(Online_Burst_ExcessPower =?= True)" 
@@ -21,10 +34,375 @@ ONLINE_INCANTATION = {"+Online_Burst_ExcessPower": "True",
 # General utils
 #
 
+# Optional file in which resolved executables are kept between processes. It
+# is only trusted while $PATH and the modification times of its directories
+# are unchanged.
+WHICH_CACHE_FILE = os.environ.get("EP_WHICH_CACHE")
+
+# Resolved executables, keyed by ($PATH, program), and the contents of the
+# $PATH directories, listed at most once per process
+_which_cache = {}
+_path_listings = {}
+_disk_caches = {}
+# The $PATHs with executables resolved since WHICH_CACHE_FILE was read
+_which_misses = set()
+
+def _path_mtimes(path):
+    mtimes = {}
+    for pdir in path.split(":"):
+        try:
+            mtimes[pdir] = os.stat(pdir).st_mtime
+        except OSError:
+            mtimes[pdir] = None
+    return mtimes
+
+def _load_which_cache(path):
+    """
+    Load the resolved executables in WHICH_CACHE_FILE, if it exists and is still valid for path. This is done once per process.
+    """
+    if path in _disk_caches:
+        return _disk_caches[path]
+    _disk_caches[path] = {}
+    if WHICH_CACHE_FILE is None or not os.path.exists(WHICH_CACHE_FILE):
+        return _disk_caches[path]
+    try:
+        with open(WHICH_CACHE_FILE) as cachef:
+            cached = json.load(cachef)
+    except (IOError, ValueError):
+        return _disk_caches[path]
+    if cached.get("path") == path and cached.get("mtimes") == _path_mtimes(path):
+        _disk_caches[path] = cached.get("programs", {})
+    return _disk_caches[path]
+
+def _store_which_cache(path):
+    """
+    Write the resolved executables for path to WHICH_CACHE_FILE, replacing it atomically.
+    """
+    if WHICH_CACHE_FILE is None:
+        return
+    programs = _load_which_cache(path)
+    programs.update((prog, exe) for (p, prog), exe in _which_cache.iteritems() if p == path)
+    cache_dir = os.path.dirname(os.path.abspath(WHICH_CACHE_FILE))
+    try:
+        fd, tmpname = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, "w") as cachef:
+            json.dump({"path": path, "mtimes": _path_mtimes(path), "programs": programs}, cachef)
+        os.rename(tmpname, WHICH_CACHE_FILE)
+    except (IOError, OSError):
+        # Not being able to cache isn't fatal
+        pass
+
+def _store_which_caches():
+    """
+    Write the executables resolved by this process to WHICH_CACHE_FILE.
+    """
+    for path in _which_misses:
+        _store_which_cache(path)
+    _which_misses.clear()
+
 def which(prog):
-    for path in os.environ["PATH"].split(":"):
-        if any([prog == prg for prg in map(os.path.basename, [p for p in glob.glob(path + "/*") if os.stat(p).st_mode & stat.S_IXUSR])]):
-            return os.path.join(path, prog)
+    """
+    Find the full path to the executable prog in $PATH, or None if it can't be found. Results are cached for the life of the process, and each $PATH directory is listed at most once, so only the candidate files are checked. If WHICH_CACHE_FILE (from the EP_WHICH_CACHE environment variable) is set, results are also kept there across processes.
+    """
+    path = os.environ.get("PATH", "")
+    if (path, prog) in _which_cache:
+        return _which_cache[(path, prog)]
+
+    disk_cache = _load_which_cache(path)
+    if prog in disk_cache:
+        _which_cache[(path, prog)] = disk_cache[prog]
+        return disk_cache[prog]
+
+    exe = None
+    for pdir in path.split(":"):
+        if pdir not in _path_listings:
+            try:
+                _path_listings[pdir] = set(os.listdir(pdir or "."))
+            except OSError:
+                _path_listings[pdir] = set()
+        if prog not in _path_listings[pdir]:
+            continue
+        candidate = os.path.join(pdir, prog)
+        try:
+            if os.stat(candidate).st_mode & stat.S_IXUSR:
+                exe = candidate
+                break
+        except OSError:
+            continue
+
+    _which_cache[(path, prog)] = exe
+    # Written once, when the process exits, rather than after every miss
+    if not _which_misses:
+        atexit.register(_store_which_caches)
+    _which_misses.add(path)
+    return exe
+
+# Number of threads used to write out jobs in finalize_jobs -- the work is
+# dominated by filesystem latency, not CPU
+FINALIZE_THREADS = 16
+
+# Directories known to exist
+_made_dirs = set()
+
+def makedirs(path):
+    """
+    Create a directory and its parents if they don't exist. Safe to call from several threads, and only checks the filesystem once per directory.
+    """
+    if path in _made_dirs:
+        return
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    _made_dirs.add(path)
+
+def write_if_changed(path, content):
+    """
+    Write content to path, unless the file already has exactly that content. The file is replaced atomically. Returns True if the file was written.
+    """
+    if os.path.exists(path):
+        with open(path) as fin:
+            if hashlib.sha1(fin.read()).digest() == hashlib.sha1(content).digest():
+                return False
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w") as fout:
+        fout.write(content)
+    os.chmod(tmpname, 0644)
+    os.rename(tmpname, path)
+    return True
+
+def write_sub_file_if_changed(job):
+    """
+    Write the submit file of a condor job, unless the existing one is identical. Returns True if the file was written.
+    """
+    sub_file = job.get_sub_file()
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(sub_file)))
+    os.close(fd)
+    try:
+        job.set_sub_file(tmpname)
+        job.write_sub_file()
+        with open(tmpname) as subf:
+            content = subf.read()
+    finally:
+        job.set_sub_file(sub_file)
+        os.unlink(tmpname)
+    return write_if_changed(sub_file, content)
+
+def finalize_jobs(jobs, nthreads=FINALIZE_THREADS):
+    """
+    Finalize (create the directories and write the configuration and submit files of) many jobs at once, using nthreads threads. Files are only rewritten when their contents change. Returns the number of files written.
+    """
+    if not jobs:
+        return 0
+    pool = ThreadPool(min(nthreads, len(jobs)))
+    try:
+        return sum(pool.map(lambda job: job.finalize(), jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+#
+# Resource estimation
+#
+
+# Optional calibration of the resource model from past jobs, written by
+# calibrate_resources
+RESOURCE_CALIBRATION_FILE = os.environ.get("EP_RESOURCE_CALIBRATION")
+
+# Memory of the gstreamer pipeline and interpreter before any data (MB)
+RESOURCE_BASE_MEMORY = 512
+# Number of maximum duration buffers of filter output held per filter
+RESOURCE_BUFFERS = 4
+# Filters are this many inverse bandwidths long
+RESOURCE_FILTER_DURATIONS = 2
+# Operations per filtered sample per log2(filter length) for FFT convolution,
+# and per tile produced
+RESOURCE_FILTER_OPS = 5
+RESOURCE_TILE_OPS = 1e3
+# Sustained operations per second of a core, and the fixed load of the
+# pipeline (cores)
+RESOURCE_OPS_PER_CPU = 1e9
+RESOURCE_BASE_CPU = 0.5
+# Headroom on the memory request, and its granularity (MB)
+RESOURCE_MEMORY_MARGIN = 1.2
+RESOURCE_MEMORY_STEP = 256
+
+_resource_calibration = {}
+
+def _tf_parameter(cfg, name, default):
+    if cfg is None or not cfg.has_section("tf_parameters") or not cfg.has_option("tf_parameters", name):
+        return default
+    val = cfg.get("tf_parameters", name)
+    return float(val) if val else default
+
+def filter_bank_size(cfg, rate):
+    """
+    Get the size of the filter bank and the time-frequency tiling that the tf_parameters section of a channel configuration produces for data sampled at rate. Returns a dictionary with the number of filters, the length of each filter in samples, the number of resolution levels, and the number of tiles produced per second.
+    """
+    nyquist = rate / 2.0
+    fmin = _tf_parameter(cfg, "min-frequency", 0.0)
+    fmax = min(_tf_parameter(cfg, "max-frequency", nyquist), nyquist)
+    min_bw = _tf_parameter(cfg, "min-bandwidth", 1.0)
+    band = max(fmax - fmin, min_bw)
+    max_bw = min(_tf_parameter(cfg, "max-bandwidth", band), band)
+    max_dur = _tf_parameter(cfg, "max-duration", 1.0)
+    max_dof = _tf_parameter(cfg, "max-dof", None)
+    fix_dof = _tf_parameter(cfg, "fix-dof", None)
+
+    nlevels, tile_rate, bw = 0, 0.0, min_bw
+    while bw <= max_bw:
+        nlevels += 1
+        nbands = band / bw
+        if fix_dof is not None:
+            tile_rate += nbands * 2 * bw / fix_dof
+        else:
+            # The shortest tile has two degrees of freedom
+            dur = 1.0 / bw
+            while dur <= max_dur and (max_dof is None or 2 * bw * dur <= max_dof):
+                tile_rate += nbands / dur
+                dur *= 2
+        bw *= 2
+
+    return {"nfilters": int(math.ceil(band / min_bw)),
+        "filter_length": int(math.ceil(RESOURCE_FILTER_DURATIONS * rate / min_bw)),
+        "nlevels": nlevels,
+        "tile_rate": tile_rate,
+        "max_duration": max_dur}
+
+def predict_usage(cfg, rate):
+    """
+    Predict the CPU (cores) and memory (MB) used by a job analyzing data sampled at rate with the channel configuration cfg, before calibration. If cfg is None, the job has no filter bank (e.g. PSD measurement).
+    """
+    mem = RESOURCE_BASE_MEMORY + RESOURCE_BUFFERS * rate * 8 / 2.0**20
+    cpu = RESOURCE_BASE_CPU
+    if cfg is None:
+        return cpu, mem
+
+    fb = filter_bank_size(cfg, rate)
+    coeffs = fb["nfilters"] * fb["filter_length"]
+    buffers = fb["nfilters"] * rate * fb["max_duration"] * RESOURCE_BUFFERS
+    mem += 8 * (coeffs + buffers) / 2.0**20
+    ops = fb["nfilters"] * rate * math.log(max(fb["filter_length"], 2), 2) * RESOURCE_FILTER_OPS
+    ops += fb["tile_rate"] * RESOURCE_TILE_OPS
+    cpu += ops / RESOURCE_OPS_PER_CPU
+    return cpu, mem
+
+def load_resource_calibration(calibration_file=None):
+    """
+    Load the scale factors for the resource model from calibration_file (RESOURCE_CALIBRATION_FILE if not given). Without a calibration, the factors are one.
+    """
+    calibration_file = calibration_file or RESOURCE_CALIBRATION_FILE
+    if calibration_file in _resource_calibration:
+        return _resource_calibration[calibration_file]
+    calib = {"cpu_scale": 1.0, "memory_scale": 1.0}
+    if calibration_file is not None and os.path.exists(calibration_file):
+        with open(calibration_file) as calibf:
+            calib.update(json.load(calibf))
+    _resource_calibration[calibration_file] = calib
+    return calib
+
+def estimate_resources(cfg, rate, calibration=None):
+    """
+    Get the number of cores and memory (MB) to request for a job analyzing data sampled at rate with the channel configuration cfg (see predict_usage). The prediction is scaled by the calibration (from load_resource_calibration if not given), and the memory is given some headroom and rounded up to RESOURCE_MEMORY_STEP.
+    """
+    cpu, mem = predict_usage(cfg, rate)
+    return _resource_request(cpu, mem, calibration)
+
+def estimate_bundle_resources(jobs, calibration=None):
+    """
+    Get the number of cores and memory (MB) to request for a job which runs the pipelines of several channels (job class instances) in one process, see EPOnlineBundleCondorJob. The channels share the fixed cost of the process.
+    """
+    cpu, mem = RESOURCE_BASE_CPU, RESOURCE_BASE_MEMORY
+    for job in jobs:
+        jcpu, jmem = predict_usage(job.cfg, job.downsample_rate or job.sample_rate)
+        cpu += jcpu - RESOURCE_BASE_CPU
+        mem += jmem - RESOURCE_BASE_MEMORY
+    return _resource_request(cpu, mem, calibration)
+
+def _resource_request(cpu, mem, calibration=None):
+    calibration = calibration or load_resource_calibration()
+    ncpu = max(1, int(math.ceil(cpu * calibration["cpu_scale"])))
+    mem *= calibration["memory_scale"] * RESOURCE_MEMORY_MARGIN
+    mem_req = int(math.ceil(mem / RESOURCE_MEMORY_STEP)) * RESOURCE_MEMORY_STEP
+    return ncpu, mem_req
+
+_log_event_re = re.compile(r"^(\d{3}) \(([\d.]+)\)")
+_log_memory_re = re.compile(r"^\s*(\d+)\s+-\s+MemoryUsage of job \(MB\)")
+_log_resource_header_re = re.compile(r"^\s*Partitionable Resources\s*:.*\bUsage\b")
+_log_resource_re = re.compile(r"^\s*(Cpus|Memory \(MB\))\s*:")
+_log_value_re = re.compile(r"\S+")
+
+def read_condor_usage(log_file):
+    """
+    Read the resource usage of the jobs which terminated in a condor user log. Returns a list of dictionaries with the peak memory (MB) and the CPU usage (cores), either of which is None if condor did not record it. The resource table of the termination event has Usage, Request and Allocated columns, right aligned under their headers, and Usage is left blank when it was not measured, so it is read from its own column rather than as the first number of the line.
+    """
+    usage, jobs, event, job = [], {}, None, None
+    # End of the Usage column of the current resource table
+    usage_end = None
+    with open(log_file) as logf:
+        for line in logf:
+            m = _log_event_re.match(line)
+            if m is not None:
+                event, job = m.groups()
+                jobs.setdefault(job, {"memory": None, "cpus": None})
+                usage_end = None
+                continue
+            if line.startswith("..."):
+                if event == "005":
+                    usage.append(jobs.pop(job))
+                event, job = None, None
+                continue
+            if job is None:
+                continue
+            m = _log_memory_re.match(line)
+            if m is not None:
+                jobs[job]["memory"] = max(jobs[job]["memory"], float(m.group(1)))
+                continue
+            if event != "005":
+                continue
+            m = _log_resource_header_re.match(line)
+            if m is not None:
+                usage_end = m.end()
+                continue
+            m = _log_resource_re.match(line)
+            if m is not None and usage_end is not None:
+                values = [v.group(0) for v in _log_value_re.finditer(line, m.end()) if v.end() <= usage_end]
+                try:
+                    value = float(values[-1])
+                except (IndexError, ValueError):
+                    # Not measured
+                    continue
+                key = "cpus" if m.group(1) == "Cpus" else "memory"
+                jobs[job][key] = max(jobs[job][key], value)
+    return usage
+
+def calibrate_resources(jobs, calibration_file=None):
+    """
+    Calibrate the resource model from the condor logs of past runs of jobs (job class instances, whose logs are in the logs directory of get_wd()). The scale factors are the largest ratio of used to predicted resources, so that none of the past jobs would have exceeded their request. The calibration is written to calibration_file (RESOURCE_CALIBRATION_FILE if not given) and returned.
+    """
+    calib = {"cpu_scale": 0.0, "memory_scale": 0.0, "njobs": 0}
+    for job in jobs:
+        cpu, mem = predict_usage(job.cfg, job.downsample_rate or job.sample_rate)
+        logs = glob.glob(os.path.join(job.get_wd(), "logs", "%s_%s_log-*.log" % (job.instrument, job.channel)))
+        for log_file in logs:
+            for used in read_condor_usage(log_file):
+                calib["njobs"] += 1
+                if used["cpus"] is not None:
+                    calib["cpu_scale"] = max(calib["cpu_scale"], used["cpus"] / cpu)
+                if used["memory"] is not None:
+                    calib["memory_scale"] = max(calib["memory_scale"], used["memory"] / mem)
+
+    # Nothing measured, leave the model alone
+    calib["cpu_scale"] = calib["cpu_scale"] or 1.0
+    calib["memory_scale"] = calib["memory_scale"] or 1.0
+
+    calibration_file = calibration_file or RESOURCE_CALIBRATION_FILE
+    if calibration_file is not None:
+        with open(calibration_file, "w") as calibf:
+            json.dump(calib, calibf, indent=2)
+    _resource_calibration[calibration_file] = calib
+    return calib
 
 #
 # Offline job classes and utils
@@ -102,7 +480,7 @@ class EPCondorJob(CondorDAGJob, object):
     def set_segments(self, segments_filename, segments_name):
         # Check for segments
         self.segments, self.segments_name = segments_filename, segments_name
-        self.add_opt("frame-segments-file", self.segments_filename)
+        self.add_opt("frame-segments-file", self.segments)
         self.add_opt("frame-segments-name", self.segments_name)
 
     def status(self, attrs=None):
@@ -132,26 +510,41 @@ class EPCondorJob(CondorDAGJob, object):
                 return
         setattr(self, attr, val)
 
+    def set_output_dir(self, path):
+        """
+        Set the directory which the trigger files are written under. Configurations name this option either output-dir or output-directory, so whichever the configuration has is set. Raises ValueError if it has neither, since the triggers would then be written somewhere else than where they are looked for.
+        """
+        for opt in ("output-dir", "output-directory"):
+            for sec in self.cfg.sections():
+                if self.cfg.has_option(sec, opt):
+                    self.cfg.set(sec, opt, path)
+                    return
+        raise ValueError("Configuration for %s has neither an output-dir nor an output-directory option" % self.full_name())
+
     def set_sample_rate(self, rate, downsample_rate=None):
         """
         Since the sample rate controls much about what the process will do and some of the default options, it has its own setter so that it can reconfigure as appropriate.
         """
 
-        if rate > 2048:
-            self.ncpu = 2
-            self.mem_req = 2048
-        else:
-            self.ncpu = 1
-            self.mem_req = 1024
-
         self.sample_rate = rate
         if downsample_rate is not None:
             self.downsample_rate = downsample_rate
+        self.ncpu, self.mem_req = estimate_resources(self.cfg, self.downsample_rate or self.sample_rate)
         self.add_opt("sample-rate", str(downsample_rate or self.sample_rate))
 
         self.add_condor_cmd("request_cpus", str(self.ncpu))
         self.add_condor_cmd("request_memory", str(self.mem_req))
 
+    def whitening_overlap(self):
+        """
+        Get the amount of data (in seconds) at the start of each job which is lost while the whitener settles, from the analyzed sample rate and the PSD FFT length (psd-fft-length in the channel configuration, DEFAULT_PSD_LENGTH if not set).
+        """
+        try:
+            psd_length = float(self.get_config_attr("psd_fft_length"))
+        except AttributeError:
+            psd_length = DEFAULT_PSD_LENGTH
+        return whitening_overlap(self.downsample_rate or self.sample_rate, psd_length)
+
     def cluster(self):
         """
         Enable clustering. WARNING: Currently, once you've set this, there's no going back. You have to make a new instance of the class to reset it.
@@ -184,15 +577,16 @@ class EPCondorJob(CondorDAGJob, object):
 
     def write_config_file(self, out_path):
         """
-        Write out configuration file for this instance of EP. If out_path is a writable stream, write out config file, but do not change internal path.
+        Write out configuration file for this instance of EP. If out_path is a writable stream, write out config file, but do not change internal path. Otherwise, the file is only rewritten if its contents change, and whether it was is returned.
         """
         if hasattr(out_path, "write"):
             self.cfg.write(out_path)
             return
 
-        with open(out_path, "w") as fout:
-            self.cfg.write(fout)
+        cfg = StringIO()
+        self.cfg.write(cfg)
         self.configuration_file = out_path
+        return write_if_changed(out_path, cfg.getvalue())
 
     def set_root_directory(self, path):
         """
@@ -213,12 +607,10 @@ class EPCondorJob(CondorDAGJob, object):
 
         self.iwd = self.get_wd()
         self.add_condor_cmd("iwd", self.iwd)
-        if not os.path.exists(self.iwd):
-            os.makedirs(self.iwd)
+        makedirs(self.iwd)
 
         log_path = os.path.join(self.iwd, "logs")
-        if not os.path.exists(log_path):
-            os.makedirs(log_path)
+        makedirs(log_path)
 
         self.out_log_path = os.path.join(log_path, "%s_%s_output-$(Cluster).out" % (self.instrument, self.channel))
         self.set_stdout_file(self.out_log_path)
@@ -228,13 +620,14 @@ class EPCondorJob(CondorDAGJob, object):
         self.set_log_file(self.log_path)
 
         cfg_file = os.path.join(self.iwd, "%s_%s_config.ini" % (self.instrument, self.channel))
-        self.write_config_file(cfg_file)
-        # Reset the path so the submit file knows where to go
-        self.set_config_file(cfg_file)
+        written = self.write_config_file(cfg_file)
+        # The configuration in memory is what was written, so only the path
+        # the submit file refers to changes
+        self.add_opt("initialization-file", self.configuration_file)
 
         self.sub_file = os.path.join(self.iwd, "%s_%s_submit.sub" % (self.instrument, self.channel))
         self.set_sub_file(self.sub_file)
-        self.write_sub_file()
+        return written + write_sub_file_if_changed(self)
 
 class RefPsdCondorJob(CondorDAGJob, object):
     """
@@ -319,7 +712,7 @@ class RefPsdCondorJob(CondorDAGJob, object):
     def set_segments(self, segments_filename, segments_name):
         # Check for segments
         self.segments, self.segments_name = segments_filename, segments_name
-        self.add_opt("frame-segments-file", self.segments_filename)
+        self.add_opt("frame-segments-file", self.segments)
         self.add_opt("frame-segments-name", self.segments_name)
 
     def status(self, attrs=None):
@@ -354,16 +747,11 @@ class RefPsdCondorJob(CondorDAGJob, object):
         Since the sample rate controls much about what the process will do and some of the default options, it has its own setter so that it can reconfigure as appropriate.
         """
 
-        if rate > 2048:
-            self.ncpu = 2
-            self.mem_req = 2048
-        else:
-            self.ncpu = 1
-            self.mem_req = 1024
-
         self.sample_rate = rate
         if downsample_rate is not None:
             self.downsample_rate = downsample_rate
+        # No filter bank to account for
+        self.ncpu, self.mem_req = estimate_resources(None, self.downsample_rate or self.sample_rate)
         self.add_opt("sample-rate", str(downsample_rate or self.sample_rate))
 
         self.add_condor_cmd("request_cpus", str(self.ncpu))
@@ -392,15 +780,16 @@ class RefPsdCondorJob(CondorDAGJob, object):
 
     def write_config_file(self, out_path):
         """
-        Write out configuration file for this instance of EP. If out_path is a writable stream, write out config file, but do not change internal path.
+        Write out configuration file for this instance of EP. If out_path is a writable stream, write out config file, but do not change internal path. Otherwise, the file is only rewritten if its contents change, and whether it was is returned.
         """
         if hasattr(out_path, "write"):
             self.cfg.write(out_path)
             return
 
-        with open(out_path, "w") as fout:
-            self.cfg.write(fout)
+        cfg = StringIO()
+        self.cfg.write(cfg)
         self.configuration_file = out_path
+        return write_if_changed(out_path, cfg.getvalue())
 
     def set_root_directory(self, path):
         """
@@ -421,12 +810,10 @@ class RefPsdCondorJob(CondorDAGJob, object):
 
         self.iwd = self.get_wd()
         self.add_condor_cmd("iwd", self.iwd)
-        if not os.path.exists(self.iwd):
-            os.makedirs(self.iwd)
+        makedirs(self.iwd)
 
         log_path = os.path.join(self.iwd, "logs")
-        if not os.path.exists(log_path):
-            os.makedirs(log_path)
+        makedirs(log_path)
 
         self.out_log_path = os.path.join(log_path, "%s_%s_ref_psd_output-$(Cluster).out" % (self.instrument, self.channel))
         self.set_stdout_file(self.out_log_path)
@@ -437,40 +824,144 @@ class RefPsdCondorJob(CondorDAGJob, object):
 
         self.sub_file = os.path.join(self.iwd, "%s_%s_ref_psd_submit.sub" % (self.instrument, self.channel))
         self.set_sub_file(self.sub_file)
-        self.write_sub_file()
+        return write_sub_file_if_changed(self)
 
-class EPBuclusterJob(CondorDAGJob, object):
+class EPClusterJob(CondorDAGJob, object):
     """
-    Class representing a type of condor job corresponding to an gstlal_excesspower job.
+    Class representing a type of condor job corresponding to an ep_stream_cluster job, which clusters the triggers of one analysis job of a channel as soon as it finishes.
     """
-    def __init__(self, channel, rootdir):
-        super(EPBuclusterJob, self).__init__(universe="vanilla", executable=which("ligolw_bucluster"))
+    def __init__(self, channel, trigger_dir, output_dir_format, rootdir):
+        super(EPClusterJob, self).__init__(universe="vanilla", executable=which("ep_stream_cluster"))
 
         self.instrument, self.channel = channel.split(":")
         self.subsys = self.channel.split("-")[0]
+        self.trigger_dir = trigger_dir
+        self.output_dir_format = output_dir_format
 
         self.root_dir = rootdir
 
-        # Amount of memory to request
-        self.mem_req = 2048
+        # Amount of memory to request, only the open clusters are held
+        self.mem_req = 1024
 
         self.add_condor_cmd("request_memory", str(self.mem_req))
 
-        #
-        # Things that are likely to be true for this
-        #
-
-        # Please be verbose, thank you!
         self.add_opt("verbose", "")
+        self.add_opt("channel-name", self.full_name())
+        self.add_opt("trigger-directory", self.trigger_dir)
+        self.add_opt("output-dir-format", self.output_dir_format)
+        self.add_opt("gps-start-time", "$(macrogpsstart)")
+        self.add_opt("gps-end-time", "$(macrogpsend)")
+        self.add_opt("output", "$(macrooutput)")
+
+        self.out_log_path = None
+        self.err_log_path = None
+        self.log_path = None
+        self.iwd = None
+
+    def do_getenv(self):
+        """
+        Pull in user environment. Useful for running EP from non-system releases.
+        """
+        self.add_condor_cmd("getenv", "True")
+
+    def get_wd(self):
+        """
+        Get the base directory for this job.
+        """
+        return os.path.join(os.path.abspath(self.root_dir), self.instrument, self.subsys, self.channel)
+
+    def full_name(self):
+        return "%s:%s" % (self.instrument, self.channel)
+
+    def output_file(self, seg):
+        """
+        Get the path of the clustered triggers over seg (see clustered_trigger_file).
+        """
+        return clustered_trigger_file(self.trigger_dir, self.output_dir_format, self.full_name(), seg)
+
+    def finalize(self):
+        """
+        Create directory structure, and write out relevant files.
+        """
+
+        self.iwd = self.get_wd()
+        self.add_condor_cmd("iwd", self.iwd)
+        makedirs(self.iwd)
 
-        # Use the 'excesspower' type cluster algorithm
-        self.add_opt("cluster-algorithm", "excesspower")
+        log_path = os.path.join(self.iwd, "logs")
+        makedirs(log_path)
+
+        self.out_log_path = os.path.join(log_path, "%s_%s_cluster_output-$(Cluster)-$(Process).out" % (self.instrument, self.channel))
+        self.set_stdout_file(self.out_log_path)
+        self.err_log_path = os.path.join(log_path, "%s_%s_cluster_error-$(Cluster)-$(Process).err" % (self.instrument, self.channel))
+        self.set_stderr_file(self.err_log_path)
+        self.log_path = os.path.join(log_path, "%s_%s_cluster_log-$(Cluster).log" % (self.instrument, self.channel))
+        self.set_log_file(self.log_path)
+
+        self.sub_file = os.path.join(self.iwd, "%s_%s_cluster_submit.sub" % (self.instrument, self.channel))
+        self.set_sub_file(self.sub_file)
+        return write_sub_file_if_changed(self)
+
+def clustered_trigger_file(trigger_dir, output_dir_format, channel, seg):
+    """
+    Get the path of the clustered triggers of channel over seg, as written by ep_stream_cluster for an EPClusterJob. These are laid out like the unclustered trigger files (following output_dir_format), but under trigger_dir with _clustered appended, so they can be found the same way without being mistaken for unclustered triggers.
+    """
+    start, end = int(math.floor(seg[0])), int(math.ceil(seg[1]))
+    instrument, chan = channel.split(":")
+    return os.path.join(trigger_dir.rstrip("/") + "_clustered", expand_output_dir(output_dir_format, channel, start), "%s-%s_EXCESSPOWER_CLUSTERED-%d-%d.xml.gz" % (instrument, chan.replace("-", "_"), start, end - start))
+
+# Length of the reduced frame files written by ep_frame_stage, and of the
+# stretch of data read by each staging job
+STAGE_FRAME_DURATION = 256  # s
+STAGE_LENGTH = 3600  # s
+
+def staged_frame_segments(seg, frame_duration=STAGE_FRAME_DURATION):
+    """
+    Get the spans of the reduced frame files which ep_frame_stage writes for seg (integer GPS times).
+    """
+    start, end = int(math.floor(seg[0])), int(math.ceil(seg[1]))
+    return segmentlist([segment(t, min(t+frame_duration, end)) for t in range(start, end, frame_duration)])
+
+def staged_frame_description(channels):
+    """
+    Get the description of the reduced frame files holding channels. It includes a hash of the set of channels, so staging jobs for different sets of channels of the same instrument (other subsystems sharing a DAG, or a configuration which gained a channel) never write, or skip, each other's files.
+    """
+    return "EP_STAGE_%s" % hashlib.sha1(",".join(sorted(set(channels)))).hexdigest()[:10]
+
+def staged_frame_path(stage_dir, instrument, channels, seg):
+    """
+    Get the path of the reduced frame file holding channels of instrument spanning seg.
+    """
+    return os.path.join(stage_dir, instrument, "%s-%s-%d-%d.gwf" % (instrument, staged_frame_description(channels), seg[0], abs(seg)))
+
+class FrameStageJob(CondorDAGJob, object):
+    """
+    Class representing a type of condor job corresponding to an ep_frame_stage job, which reads the frames of an instrument once and writes the configured channels to reduced frames for the analysis jobs of all of them.
+    """
+    def __init__(self, instrument, channels, cache_file, stage_dir, rootdir, frame_duration=STAGE_FRAME_DURATION, tag="all"):
+        super(FrameStageJob, self).__init__(universe="vanilla", executable=which("ep_frame_stage"))
+
+        self.instrument = instrument
+        # Distinguishes the staging jobs of different sets of channels
+        self.tag = tag
+        self.channels = channels
+        self.stage_dir = stage_dir
+        self.frame_duration = frame_duration
+
+        self.root_dir = rootdir
 
-        # Look for triggers from gstlal_excesspower
-        self.add_opt("program", "gstlal_excesspower")
+        # Amount of memory to request
+        self.mem_req = 2048
 
-        # WHere to get input
-        self.add_opt("input-cache", "$(macroinpcache)")
+        self.add_condor_cmd("request_memory", str(self.mem_req))
+
+        self.add_opt("frame-cache", cache_file)
+        self.add_opt("gps-start-time", "$(macrogpsstart)")
+        self.add_opt("gps-end-time", "$(macrogpsend)")
+        self.add_opt("output-directory", self.stage_dir)
+        self.add_opt("frame-duration", str(self.frame_duration))
+        for channel in self.channels:
+            self.add_arg("--channel-name=%s" % channel)
 
         self.out_log_path = None
         self.err_log_path = None
@@ -482,20 +973,25 @@ class EPBuclusterJob(CondorDAGJob, object):
         Pull in user environment. Useful for running EP from non-system releases.
         """
         self.add_condor_cmd("getenv", "True")
-        # FIXME: This should be a toggle, so we need to test:
-        # del self.__condor_cmds["getenv"]
 
-    def set_root_directory(self, path):
+    def get_wd(self):
         """
-        Set the root directory from which to stage this job.
+        Get the base directory for this job.
         """
-        self.root_dir = path
+        return os.path.join(os.path.abspath(self.root_dir), self.instrument, "FRAME_STAGE")
 
-    def get_wd(self):
+    def write_cache(self, segl, cache_name):
         """
-        Get the base directory for this job.
+        Write the LAL cache of the reduced frames which this job will write over the segments segl.
         """
-        return os.path.join(os.path.abspath(self.root_dir), self.instrument, self.subsys, self.channel)
+        cache = Cache()
+        desc = "%s_%s" % (self.instrument, staged_frame_description(self.channels))
+        for seg in segl:
+            for fseg in staged_frame_segments(seg, self.frame_duration):
+                path = staged_frame_path(self.stage_dir, self.instrument, self.channels, fseg)
+                cache.append(CacheEntry(self.instrument[0], desc, fseg, "file://localhost" + path))
+        with open(cache_name, "w") as cachef:
+            cache.tofile(cachef)
 
     def finalize(self):
         """
@@ -504,23 +1000,21 @@ class EPBuclusterJob(CondorDAGJob, object):
 
         self.iwd = self.get_wd()
         self.add_condor_cmd("iwd", self.iwd)
-        if not os.path.exists(self.iwd):
-            os.makedirs(self.iwd)
+        makedirs(self.iwd)
 
         log_path = os.path.join(self.iwd, "logs")
-        if not os.path.exists(log_path):
-            os.makedirs(log_path)
+        makedirs(log_path)
 
-        self.out_log_path = os.path.join(log_path, "%s_%s_bucluster_output-$(Cluster).out" % (self.instrument, self.channel))
+        self.out_log_path = os.path.join(log_path, "%s_%s_frame_stage_output-$(Cluster)-$(Process).out" % (self.instrument, self.tag))
         self.set_stdout_file(self.out_log_path)
-        self.err_log_path = os.path.join(log_path, "%s_%s_bucluster_error-$(Cluster).err" % (self.instrument, self.channel))
+        self.err_log_path = os.path.join(log_path, "%s_%s_frame_stage_error-$(Cluster)-$(Process).err" % (self.instrument, self.tag))
         self.set_stderr_file(self.err_log_path)
-        self.log_path = os.path.join(log_path, "%s_%s_bucluster_log-$(Cluster).log" % (self.instrument, self.channel))
+        self.log_path = os.path.join(log_path, "%s_%s_frame_stage_log-$(Cluster).log" % (self.instrument, self.tag))
         self.set_log_file(self.log_path)
 
-        self.sub_file = os.path.join(self.iwd, "%s_%s_bucluster_submit.sub" % (self.instrument, self.channel))
+        self.sub_file = os.path.join(self.iwd, "%s_%s_frame_stage_submit.sub" % (self.instrument, self.tag))
         self.set_sub_file(self.sub_file)
-        self.write_sub_file()
+        return write_sub_file_if_changed(self)
 
 def subdivide(seg, length, min_len=0):
     """
@@ -562,16 +1056,180 @@ def shift_to_overlap(segl, shift, skip_first=True):
         segl[i] = segment(segl[i][0] - shift, segl[i][1])
     return segl
 
-# FIXME: Make loss of whitening time not hardcoded to 120 seconds -- it
-# could be much larger for lower rate channels
-WHITEN_TIME = 120  # s
-def write_offline_dag(seg, ini_file, cache_file, trigger_dir=None, subd_intrv=3600*4, rootdir='./', segments_file=None, segments_name=None, write_script=False, write_subdags=False, clustering=True, meansure_psd=False):
+# PSD FFT length used if the channel configuration doesn't specify one --
+# linked to the default in gstlal_excesspower
+DEFAULT_PSD_LENGTH = 8  # s
+
+# The PSD FFT must contain at least this many samples, so low rate channels
+# use longer FFTs
+WHITEN_MIN_FFT_SAMPLES = 1024
+
+# Number of PSD FFT lengths the whitener's running average needs before the
+# output is usable
+WHITEN_SETTLE_FFTS = 15
+
+def whitening_overlap(sample_rate, psd_length=DEFAULT_PSD_LENGTH):
+    """
+    Get the length of data (in seconds) lost to the whitener at the start of a job analyzing data at sample_rate with a PSD FFT length of psd_length seconds. The FFT length is raised to contain at least WHITEN_MIN_FFT_SAMPLES samples, and the whitener needs WHITEN_SETTLE_FFTS of them to settle. With the default PSD FFT length this is the 120 s which used to be the fixed overlap of every channel, channels with shorter FFTs lose less.
+    """
+    fft_length = max(float(psd_length), float(WHITEN_MIN_FFT_SAMPLES) / sample_rate)
+    return int(math.ceil(fft_length * WHITEN_SETTLE_FFTS))
+
+def merge_short_gaps(segl, max_gap):
+    """
+    Coalesce segl, then merge adjacent segments separated by gaps shorter than max_gap. A restarted job loses max_gap (the whitening overlap) of data, so analyzing through a shorter gap is cheaper. Returns a new segmentlist.
     """
-    Write a DAG for a set of channels with segments provided through the segment list dictionary (seg_dict). subd_intrv is the interval over which segments larger than this number will be subdivded into individual jobs. Segments of time that are directly adjacent will be overlapped so as not to lose time to whitening effects.
-		FIXME: Fixed PSD options
+    merged = segmentlist([])
+    for seg in segmentlist(segl).coalesce():
+        if merged and seg[0] - merged[-1][1] < max_gap:
+            merged[-1] = segment(merged[-1][0], seg[1])
+        else:
+            merged.append(seg)
+    return merged
+
+def plan_segments(segl, overlap, job_length):
+    """
+    Plan the analysis jobs for a segment list. Gaps shorter than overlap are merged, then each remaining segment is split into the smallest number of equal length jobs no longer than job_length which overlap by overlap seconds, so that no data after the first overlap of the segment is lost to whitening. Segments no longer than overlap can't be analyzed and are dropped.
+
+    Input segment: (0, 1000] overlap 100 job length 400
+    Output segment(s): (0, 400], (300, 700], (600, 1000]
+
+    Returns the job segments and the total overlapped (whitening) time.
+    """
+    if job_length <= overlap:
+        raise ValueError("Job length (%g s) must be longer than the whitening overlap (%g s)" % (job_length, overlap))
+
+    jobs, lost = segmentlist([]), 0
+    for seg in merge_short_gaps(segl, overlap):
+        if abs(seg) <= overlap:
+            continue
+        useful = float(abs(seg) - overlap)
+        njobs = int(math.ceil(useful / (job_length - overlap)))
+        stride = useful / njobs
+        for i in range(njobs):
+            start = seg[0] + i*stride
+            end = seg[1] if i == njobs - 1 else start + stride + overlap
+            jobs.append(segment(start, end))
+        lost += njobs * overlap
+    return jobs, lost
+
+def channel_segments(segs, channel):
+    """
+    Get the segment list for channel from segs, which can be a single segment, a segmentlist, or a segmentlistdict keyed by channel name or instrument.
+    """
+    if isinstance(segs, segment):
+        return segmentlist([segs])
+    if isinstance(segs, dict):
+        if channel in segs:
+            return segmentlist(segs[channel])
+        return segmentlist(segs.get(channel.split(":")[0], []))
+    return segmentlist(segs)
+
+def read_segments(segments_file, segments_name):
+    """
+    Read the segments named segments_name from a LIGOLW segment file (as given to --frame-segments-file). Returns a segmentlistdict keyed by instrument.
+    """
+    from glue.ligolw import utils as ligolw_utils
+    from glue.ligolw.utils import segments as ligolw_segments
+    xmldoc = ligolw_utils.load_filename(segments_file, contenthandler=ligolw_segments.LIGOLWContentHandler)
+    return ligolw_segments.segmenttable_get_by_name(xmldoc, segments_name).coalesce()
+#
+# Incremental planning
+#
+
+# Fraction of a job's analyzed span which may lack trigger files for the job
+# to still count as complete, when DAGMan didn't record it
+MANIFEST_COVERAGE_TOLERANCE = 0.01
+
+def node_name(kind, channel, seg):
+    """
+    Get the deterministic DAG node name for a job of kind for channel over seg, so that nodes can be matched between runs.
+    """
+    return "%s_%s_%d_%d" % (kind, channel.replace(":","_").replace("-","_"), int(math.floor(seg[0])), int(math.ceil(seg[1])))
+
+def job_config_hash(job, overlap):
+    """
+    Hash everything about an analysis job which would change its output: its excesspower configuration, sample rates and whitening overlap.
+    """
+    cfg = StringIO()
+    job.write_config_file(cfg)
+    return hashlib.sha1(json.dumps([cfg.getvalue(), job.sample_rate, job.downsample_rate, overlap])).hexdigest()
+
+def load_manifest(manifest_file):
+    """
+    Load the manifest of planned analysis nodes, keyed by node name. Missing manifests are empty.
+    """
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as manf:
+        return json.load(manf)
+
+def write_manifest(manifest, manifest_file):
+    """
+    Write the manifest of planned analysis nodes, replacing manifest_file atomically.
+    """
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(manifest_file)))
+    with os.fdopen(fd, "w") as manf:
+        json.dump(manifest, manf, indent=1, sort_keys=True)
+    os.rename(tmpname, manifest_file)
+
+def _rescue_dags(dag_file):
+    return sorted(glob.glob(dag_file + ".rescue[0-9][0-9][0-9]"))
+
+def read_rescue_dags(dag_file):
+    """
+    Get the names of the nodes that the latest rescue DAG of dag_file records as done.
+    """
+    rescues = _rescue_dags(dag_file)
+    if not rescues:
+        return set()
+    done = set()
+    with open(rescues[-1]) as rescuef:
+        for line in rescuef:
+            tokens = line.split()
+            if len(tokens) >= 2 and tokens[0] == "DONE":
+                done.update(tokens[1:])
+    return done
+
+def retire_rescue_dags(dag_file):
+    """
+    Rename the rescue DAGs of dag_file once they have been read, since DAGMan would otherwise apply them to a regenerated DAG with different nodes.
+    """
+    for rescue in _rescue_dags(dag_file):
+        os.rename(rescue, rescue + ".old")
+
+def _node_outputs(seg, files):
+    """
+    Get the trigger files of files (a list of (path, segment), in time order) which overlap seg.
+    """
+    return [path for path, fseg in files if fseg.intersects(seg)]
+
+def _node_complete(name, entry, files, done_nodes):
+    """
+    An analysis node is complete if DAGMan recorded it as done, or its trigger files (recorded in the manifest, or found on disk and given in files, see _node_outputs) still cover its analyzed span.
+    """
+    seg = segment(*entry["segment"])
+    if entry.get("outputs"):
+        return all(map(os.path.exists, entry["outputs"]))
+    if name in done_nodes:
+        return True
+    analyzed = segment(seg[0] + entry["overlap"], seg[1])
+    covered = segmentlist([fseg for path, fseg in files if fseg.intersects(seg)]).coalesce()
+    missing = abs(segmentlist([analyzed]) - covered)
+    return missing <= MANIFEST_COVERAGE_TOLERANCE * abs(analyzed)
+
+def write_offline_dag(segs, ini_files, cache_file, trigger_dir=None, job_wall_time=3600*4, rootdir='./', segments_file=None, segments_name=None, write_script=False, write_subdags=False, clustering=True, measure_psd=False, stage_frames=False, stage_dir=None, dag=None, manifest_file=None, done_nodes=None, incremental=True):
+    """
+    Write a DAG for the channels of one or more subsystem configurations (ini_files, a path or a list of paths). segs is either a single segment, a segmentlist, or a segmentlistdict of science segments keyed by channel name or instrument (see channel_segments). Each channel's segments are planned with plan_segments: gaps shorter than the whitening overlap of the channel (see EPCondorJob.whitening_overlap) are bridged, and the remainder is divided into equal jobs which take about job_wall_time to run. The speed at which a channel is processed, in seconds of data per second of wall time, is taken from the 'realtime_factor' option of its section (default 1). The fraction of analyzed time lost to overlaps is reported for each channel and in total.
+
+    If stage_frames is set, a FrameStageJob for each instrument reads the frames once (in STAGE_LENGTH pieces covering all of the planned jobs) and writes the configured channels of every subsystem to reduced frames in stage_dir (rootdir/frames if not given), which the analysis jobs read instead. Subsystems should therefore be given together rather than in separate calls, which would each read the frames again.
+
+    The nodes are added to dag (a new DAG if not given), which is returned, so several subsystems can share one DAG. Planned analysis nodes are recorded in a JSON manifest (manifest_file, rootdir/excesspower_manifest.json by default) with a hash of their configuration. If incremental is set, time already covered by complete nodes with an unchanged configuration is not planned again, so only new or failed time, or channels whose configuration changed, get jobs. A node is complete if it is in done_nodes (see read_rescue_dags) or its trigger files cover its analyzed span. Trigger files are found with a TriggerFileFinder, following the output-dir-format of each channel, and the directory listings are kept in rootdir/caches.
+
+    If clustering is set, each analysis node gets an EPClusterJob child which clusters the triggers of its analyzed span (after the whitening overlap) as soon as it finishes, rather than waiting on every node in a GPS directory. Complete nodes whose clustered triggers are missing are clustered again.
     """
     cfgp = ConfigParser()
-    res = cfgp.read(ini_file)
+    res = cfgp.read(ini_files)
     if res == []:
         raise ValueError("No configuration files read")
 
@@ -581,21 +1239,123 @@ def write_offline_dag(seg, ini_file, cache_file, trigger_dir=None, subd_intrv=36
     # Expand out the cache file to ensure no relative path names
     cache_file = os.path.abspath(cache_file)
 
-    uberdag = CondorDAG(log=rootdir)
-    #for channel, segl in seg_dict.iteritems():
+    manifest_file = manifest_file or os.path.join(rootdir, "excesspower_manifest.json")
+    manifest = load_manifest(manifest_file)
+    if not incremental:
+        # Forget these channels, but keep any other subsystems
+        manifest = dict((name, entry) for name, entry in manifest.iteritems() if entry["channel"] not in cfgp.sections())
+    done_nodes = done_nodes or set()
+
+    # Directory listings of the trigger files, so repeated planning only
+    # looks at new files
+    discovery_dir = os.path.join(rootdir, "caches")
+    makedirs(discovery_dir)
+
+    #
+    # Plan the jobs over the science segments first, so the frame staging
+    # covers all of the channels. Segments which would be entirely thrown
+    # away due to whitener effects are dropped
+    # NOTE: This won't be a problem with a fix-psd option
+    #
+    plans = OrderedDict()
     for channel in cfgp.sections():
-        print "Channel %s, full analysis segment %s" % (channel, seg)
+        segl = channel_segments(segs, channel).coalesce()
+        if not segl:
+            print >>sys.stderr, "Channel %s has no analysis segments, skipping" % channel
+            continue
+        ep_job = EPCondorJob.from_config_section(cfgp, channel, rootdir)
+        ep_job.set_output_dir(trigger_dir)
+        finder = TriggerFileFinder.from_config(ep_job.cfg, channel, trigger_dir, manifest_file=os.path.join(discovery_dir, "%s_trigger_files.json" % channel.replace(":","_").replace("-","_")))
+        overlap = ep_job.whitening_overlap()
+        config_hash = job_config_hash(ep_job, overlap)
+
+        # Time already analyzed with this configuration; everything else
+        # recorded for the channel is stale and gets replanned
+        # The trigger files of all of the nodes are found at once
+        entries = [(name, entry) for name, entry in manifest.items() if entry["channel"] == channel]
+        spans = segmentlist([segment(*entry["segment"]) for name, entry in entries if entry["config_hash"] == config_hash and not entry.get("outputs")])
+        files = [(path, trigger_file_segment(path)) for path in finder.find_all(spans)] if spans else []
+        covered, recluster = segmentlist([]), segmentlist([])
+        for name, entry in entries:
+            if entry["config_hash"] == config_hash and _node_complete(name, entry, files, done_nodes):
+                seg = segment(*entry["segment"])
+                entry["outputs"] = entry.get("outputs") or _node_outputs(seg, files)
+                analyzed = segment(seg[0] + entry["overlap"], seg[1])
+                covered.append(analyzed)
+                if clustering and not os.path.exists(clustered_trigger_file(trigger_dir, finder.fmt, channel, analyzed)):
+                    recluster.append(analyzed)
+            else:
+                del manifest[name]
+        covered.coalesce()
+
+        # Restart where the covered time ends, allowing for the whitener
+        todo = segmentlist([])
+        for seg in segl - covered:
+            if covered.intersects_segment(segment(seg[0] - overlap, seg[0])):
+                seg = segment(seg[0] - overlap, seg[1])
+            todo.append(seg)
+
+        if cfgp.has_option(channel, "realtime_factor"):
+            job_length = job_wall_time * cfgp.getfloat(channel, "realtime_factor")
+        else:
+            job_length = job_wall_time
+        job_segs, lost = plan_segments(todo, overlap, max(job_length, 2*overlap))
+        if not job_segs and not recluster:
+            print "Channel %s is up to date" % channel
+            continue
+
+        for subseg in job_segs:
+            manifest[node_name("ep", channel, subseg)] = {"channel": channel, "segment": [subseg[0], subseg[1]], "overlap": overlap, "config_hash": config_hash, "outputs": []}
+        plans[channel] = (segl, ep_job, finder, overlap, job_segs, lost, recluster)
+
+    uberdag = dag or CondorDAG(log=rootdir)
+
+    #
+    # Read each frame once for all of the channels of an instrument
+    #
+    stage_nodes, stage_caches = {}, {}
+    if stage_frames:
+        stage_dir = os.path.abspath(stage_dir or os.path.join(rootdir, "frames"))
+        for inst, chans in itertools.groupby(sorted(plans), lambda c: c.split(":")[0]):
+            chans = list(chans)
+            stage_segs = segmentlist([])
+            for chan in chans:
+                stage_segs.extend(plans[chan][4])
+            stage_segs = segmentlist([segment(int(math.floor(s[0])), int(math.ceil(s[1]))) for s in stage_segs.coalesce()])
+
+            stage_segs = segmentlist([segment(t, min(t+STAGE_LENGTH, seg[1])) for seg in stage_segs for t in range(seg[0], seg[1], STAGE_LENGTH)])
+
+            stage_job = FrameStageJob(inst, chans, cache_file, stage_dir, rootdir)
+            stage_job.do_getenv()
+            stage_job.finalize()
+            stage_caches[inst] = os.path.abspath(os.path.join(rootdir, "caches/excesspower_%s_stage.cache" % inst))
+            stage_job.write_cache(stage_segs, stage_caches[inst])
+
+            stage_nodes[inst] = []
+            for subseg in stage_segs:
+                node = CondorDAGNode(stage_job)
+                node.set_name(node_name("stage", inst, subseg))
+                node.add_macro("macrogpsstart", subseg[0])
+                node.add_macro("macrogpsend", subseg[1])
+                uberdag.add_node(node)
+                stage_nodes[inst].append((subseg, node))
+
+    total_time, total_lost = 0, 0
+    for channel, (segl, ep_job, finder, overlap, job_segs, lost, recluster) in plans.iteritems():
+        print "Channel %s, full analysis segment %s" % (channel, segl.extent())
         chan_sanitized = channel.replace(":","_").replace("-","_")
         subdag = CondorDAG(log=rootdir)
+        chan_cache = stage_caches.get(ep_job.instrument, cache_file)
+        chan_stage_nodes = stage_nodes.get(ep_job.instrument, [])
 
         #
         # Measure the PSD for EP to use later
         # 
         if measure_psd:
             ref_psd_job = RefPsdCondorJob.from_config_section(cfgp, channel, rootdir)
-            ref_psd_job.set_data_source(cache_filename=cache_file)
+            ref_psd_job.set_data_source(cache_filename=chan_cache)
             if segments_file is not None:
-                ref_psd_job.set_segments(segments_filename=segments_file, segments_name=name)
+                ref_psd_job.set_segments(segments_filename=segments_file, segments_name=segments_name)
 
             ref_psd_job.do_getenv()
             ref_psd_job.finalize()
@@ -603,89 +1363,84 @@ def write_offline_dag(seg, ini_file, cache_file, trigger_dir=None, subd_intrv=36
         #
         # Generate analysis job
         # 
-        ep_job = EPCondorJob.from_config_section(cfgp, channel, rootdir)
-        ep_job.set_data_source(cache_filename=cache_file)
+        ep_job.set_data_source(cache_filename=chan_cache)
         if segments_file is not None:
-            ep_job.set_segments(segments_filename=segments_file, segments_name=name)
-
-        ep_job.set_config_attr("output-directory", trigger_dir)
+            ep_job.set_segments(segments_filename=segments_file, segments_name=segments_name)
 
         ep_job.do_getenv()
-        input_path = os.path.join(ep_job.get_config_attr("output-directory"), ep_job.instrument, ep_job.channel.replace(":", "/") + "_excesspower")
         ep_job.finalize()
 
-        #
-        # Subdivide and prune segments which we simply can't analyze because 
-        # the entire segment would be thrown away due to whitener effets
-        # NOTE: This won't be a problem with a fix-psd option
-        # 
+        analyzed = float(abs(job_segs))
+        total_time += analyzed
+        total_lost += lost
+        print "Channel %s: %d jobs, whitening overlap %d s, %.1f%% of analyzed time lost to overlap" % (channel, len(job_segs), overlap, 100 * lost / analyzed if analyzed else 0)
+
         analysis_segments = {}
-        for subsegl in [shift_to_overlap(subdivide(seg, subd_intrv, WHITEN_TIME), WHITEN_TIME)]:
-            for subseg in subsegl:
-
-                if measure_psd:
-                    psdnode = CondorDAGNode(ref_psd_job)
-                    psd_out_path = os.path.abspath(os.path.join(rootdir, "spectra/%s-gstlal_reference_psd-%d-%d.xml.gz" % (ref_psd_job.instrument, subseg[0], abs(subseg))))
-                    psdnode.add_macro("macropsdname", psd_out_path) 
-                    psdnode.add_macro("macrogpsstart", subseg[0]) 
-                    psdnode.add_macro("macrogpsend", subseg[1]) 
-                    subdag.add_node(psdnode)
-                    uberdag.add_node(psdnode)
-
-                pnode = CondorDAGNode(ep_job)
-                pnode.add_macro("macrogpsstart", subseg[0]) 
-                pnode.add_macro("macrogpsend", subseg[1]) 
-                subdag.add_node(pnode)
-                uberdag.add_node(pnode)
-                analysis_segments[subseg] = pnode
-
-                if measure_psd:
-                    pnode.add_parent(psdnode)
+        for subseg in job_segs:
+
+            if measure_psd:
+                psdnode = CondorDAGNode(ref_psd_job)
+                psdnode.set_name(node_name("psd", channel, subseg))
+                psd_out_path = os.path.abspath(os.path.join(rootdir, "spectra/%s-gstlal_reference_psd-%d-%d.xml.gz" % (ref_psd_job.instrument, subseg[0], abs(subseg))))
+                psdnode.add_macro("macropsdname", psd_out_path) 
+                psdnode.add_macro("macrogpsstart", subseg[0]) 
+                psdnode.add_macro("macrogpsend", subseg[1]) 
+                for sseg, snode in chan_stage_nodes:
+                    if sseg.intersects(subseg):
+                        psdnode.add_parent(snode)
+                subdag.add_node(psdnode)
+                uberdag.add_node(psdnode)
+
+            pnode = CondorDAGNode(ep_job)
+            pnode.set_name(node_name("ep", channel, subseg))
+            pnode.add_macro("macrogpsstart", subseg[0]) 
+            pnode.add_macro("macrogpsend", subseg[1]) 
+            for sseg, snode in chan_stage_nodes:
+                if sseg.intersects(subseg):
+                    pnode.add_parent(snode)
+            subdag.add_node(pnode)
+            uberdag.add_node(pnode)
+            analysis_segments[subseg] = pnode
+
+            if measure_psd:
+                pnode.add_parent(psdnode)
 
         #
-        # Cluster the output according to the 5 digit GPS directories that
-        # should be created by excesspower
-        # FIXME: If the output format gets changed, this will break
-        # 
-        ep_bucl_job = EPBuclusterJob(channel, rootdir)
-        ep_bucl_job.do_getenv()
-        ep_bucl_job.finalize()
-        gps_group, cur_gps = 1e5, seg[0]
-
-        while cur_gps < seg[1]:
-            subdir = str(cur_gps)[:5]
-            gps_seg = segment(cur_gps, cur_gps+1e5)
-            cache_path = os.path.join(input_path, subdir)
-
-            cache_name = os.path.abspath(os.path.join(rootdir, "caches/excesspower_%s_%s.cache" % (chan_sanitized, subdir)))
-
-            node = CondorDAGNode(ep_bucl_job)
-            node.set_pre_script(os.path.abspath("find_trig_files.sh"))
-            node.add_pre_script_arg(cache_path)
-            node.add_pre_script_arg(cache_name)
-            node.add_macro("macroinpcache", cache_name)
-
-            if clustering:
-                for aseg, anode in analysis_segments.iteritems():
-                    try:
-                        gps_seg & aseg
-                        node.add_parent(anode)
-                    except ValueError:
-                        pass
+        # Cluster the triggers of each analysis job when it finishes, and
+        # those of earlier jobs which were never clustered
+        #
+        if clustering:
+            cluster_job = EPClusterJob(channel, trigger_dir, finder.fmt, rootdir)
+            cluster_job.do_getenv()
+            cluster_job.finalize()
+
+            to_cluster = [(segment(subseg[0] + overlap, subseg[1]), pnode) for subseg, pnode in sorted(analysis_segments.iteritems())]
+            to_cluster += [(aseg, None) for aseg in recluster]
+            for aseg, pnode in to_cluster:
+                node = CondorDAGNode(cluster_job)
+                node.set_name(node_name("cluster", channel, aseg))
+                node.add_macro("macrogpsstart", aseg[0])
+                node.add_macro("macrogpsend", aseg[1])
+                node.add_macro("macrooutput", cluster_job.output_file(aseg))
+                if pnode is not None:
+                    node.add_parent(pnode)
                 subdag.add_node(node)
                 uberdag.add_node(node)
 
-            cur_gps += gps_group
-
         # TODO: Add plot jobs here
 
-        dagname = "excesspower_%s_%d_%d" % (chan_sanitized, seg[0], seg[1])
+        extent = (job_segs or recluster).extent()
+        dagname = "excesspower_%s_%d_%d" % (chan_sanitized, extent[0], extent[1])
         subdag.set_dag_file(dagname)
         if write_subdags:
             subdag.write_concrete_dag()
         if write_script:
             subdag.write_script()
 
+    write_manifest(manifest, manifest_file)
+
+    if total_time:
+        print "Total: %.1f%% of %d s of analyzed time lost to whitening overlap" % (100 * total_lost / total_time, total_time)
     return uberdag
 
 #
@@ -697,43 +1452,47 @@ class EPOnlineCondorJob(CondorJob, object):
     """
     Class representing a type of condor job corresponding to an online (never-ending) gstlal_excesspower job.
     """
+    # The entries of status(), in order
+    STATUS_KEYS = ('instrument', 'subsys', 'channel', "sample_rate", "downsample_rate", 'configuration_file', 'dq_channel', 'off_bits', 'on_bits', 'shm_part_name')
+
     @classmethod
     def from_config_section(cls, cfgp, sec, rootdir):
         """
         Create an instance from a section in a subsystem configuration file.
         """
-        chan_cfg_file = cfgp.get(sec, "configuration_file")
-        manager = EPOnlineCondorJob(sec, chan_cfg_file, rootdir)
-
-        sample_rate = cfgp.getint(sec, "sample_rate")
-        if cfgp.has_option(sec, "downsample_rate"):
-            ds_rate = cfgp.get(sec, "downsample_rate")
-        if ds_rate:
-            ds_rate = int(ds_rate)
-        else:
-            ds_rate = None
-        manager.set_sample_rate(sample_rate, ds_rate)
+        settings = cls.read_config_section(cfgp, sec)
+        manager = EPOnlineCondorJob(sec, settings["configuration_file"], rootdir)
+        manager.set_sample_rate(settings["sample_rate"], settings["downsample_rate"])
+        manager.set_shm_partition(settings["shm_part_name"])
+        manager.set_dq_channel(settings["dq_channel"], settings["on_bits"], settings["off_bits"])
+        return manager
 
+    @staticmethod
+    def read_config_section(cfgp, sec):
+        """
+        Read the settings of a channel from its section in a subsystem configuration file, as a dictionary keyed by the job attribute they set. The DQ bits are hex, and only apply with a DQ channel.
+        """
+        settings = {"configuration_file": cfgp.get(sec, "configuration_file"), "sample_rate": cfgp.getint(sec, "sample_rate"), "downsample_rate": None, "shm_part_name": None, "dq_channel": None, "on_bits": None, "off_bits": None}
+        if cfgp.has_option(sec, "downsample_rate") and cfgp.get(sec, "downsample_rate"):
+            settings["downsample_rate"] = int(cfgp.get(sec, "downsample_rate"))
         if cfgp.has_option(sec, "shm_part_name"):
-				    manager.set_shm_partition(cfgp.get(sec, "shm_part_name"))
-        else:
-				    manager.set_shm_partition(None)
-
-        odc_chan, on_bits, off_bits = None, None, None
+            settings["shm_part_name"] = cfgp.get(sec, "shm_part_name")
         if cfgp.has_option(sec, "dq_channel"):
-            odc_chan = cfgp.get(sec, "dq_channel")
-        if cfgp.has_option(sec, "on_bits"):
-            if cfgp.get(sec, "on_bits"):
-                on_bits = int(cfgp.get(sec, "on_bits"), 16)
-            else:
-                on_bits = None
-        if cfgp.has_option(sec, "off_bits"):
-            if cfgp.get(sec, "off_bits"):
-                off_bits = int(cfgp.get(sec, "off_bits"), 16)
-            else:
-                off_bits = None
-        manager.set_dq_channel(odc_chan, on_bits, off_bits)
-        return manager
+            settings["dq_channel"] = cfgp.get(sec, "dq_channel")
+            for bits in ("on_bits", "off_bits"):
+                if cfgp.has_option(sec, bits) and cfgp.get(sec, bits):
+                    settings[bits] = int(cfgp.get(sec, bits), 16)
+        return settings
+
+    @classmethod
+    def section_status(cls, cfgp, sec):
+        """
+        Get the status of a channel (the same entries as status()) from its section in a subsystem configuration file, without creating its condor job.
+        """
+        settings = cls.read_config_section(cfgp, sec)
+        settings["instrument"], settings["channel"] = sec.split(":")
+        settings["subsys"] = settings["channel"].split("-")[0]
+        return OrderedDict([(k, settings[k]) for k in cls.STATUS_KEYS])
 
     def __init__(self, channel, configuration_file, rootdir):
         super(EPOnlineCondorJob, self).__init__(universe="vanilla", executable=which("gstlal_excesspower"), queue=1)
@@ -793,7 +1552,18 @@ class EPOnlineCondorJob(CondorJob, object):
         self.iwd = None
 
     def status(self, attrs=None):
-        return OrderedDict([ (k, getattr(self, k)) for k in ['instrument', 'subsys', 'channel', "sample_rate", "downsample_rate", 'configuration_file', 'dq_channel', 'off_bits', 'on_bits', 'shm_part_name']])
+        return OrderedDict([ (k, getattr(self, k)) for k in self.STATUS_KEYS])
+
+    def command_line(self):
+        """
+        Get the command line which runs this job outside of condor (e.g. from ep_bundle), as a list of arguments.
+        """
+        cmd = [self.get_executable()]
+        for opt, val in self.get_opts().iteritems():
+            cmd.append("--%s" % opt)
+            if val:
+                cmd.append(str(val))
+        return cmd + list(self.get_args())
 
     def condor_status(self, attrs=None):
         return OrderedDict([ (k, getattr(self, k)) for k in ['ncpu', 'mem_req', 'root_dir', 'iwd', 'log_path', 'err_log_path', 'out_log_path']])
@@ -824,16 +1594,10 @@ class EPOnlineCondorJob(CondorJob, object):
         Since the sample rate controls much about what the process will do and some of the default options, it has its own setter so that it can reconfigure as appropriate.
         """
 
-        if rate > 2048:
-            self.ncpu = 2
-            self.mem_req = 2048
-        else:
-            self.ncpu = 1
-            self.mem_req = 1024
-
         self.sample_rate = rate
         if downsample_rate is not None:
             self.downsample_rate = downsample_rate
+        self.ncpu, self.mem_req = estimate_resources(self.cfg, self.downsample_rate or self.sample_rate)
         self.add_opt("sample-rate", str(self.downsample_rate or self.sample_rate))
 
         self.add_condor_cmd("request_cpus", str(self.ncpu))
@@ -892,15 +1656,16 @@ class EPOnlineCondorJob(CondorJob, object):
 
     def write_config_file(self, out_path):
         """
-        Write out configuration file for this instance of EP. If out_path is a writable stream, write out config file, but do not change internal path.
+        Write out configuration file for this instance of EP. If out_path is a writable stream, write out config file, but do not change internal path. Otherwise, the file is only rewritten if its contents change, and whether it was is returned.
         """
         if hasattr(out_path, "write"):
             self.cfg.write(out_path)
             return
 
-        with open(out_path, "w") as fout:
-            self.cfg.write(fout)
+        cfg = StringIO()
+        self.cfg.write(cfg)
         self.configuration_file = out_path
+        return write_if_changed(out_path, cfg.getvalue())
 
     def set_root_directory(self, path):
         """
@@ -921,12 +1686,10 @@ class EPOnlineCondorJob(CondorJob, object):
 
         self.iwd = self.get_wd()
         self.add_condor_cmd("iwd", self.iwd)
-        if not os.path.exists(self.iwd):
-            os.makedirs(self.iwd)
+        makedirs(self.iwd)
 
         log_path = os.path.join(self.iwd, "logs")
-        if not os.path.exists(log_path):
-            os.makedirs(log_path)
+        makedirs(log_path)
 
         self.out_log_path = os.path.join(log_path, "%s_%s_output-$(Cluster).out" % (self.instrument, self.channel))
         self.set_stdout_file(self.out_log_path)
@@ -936,13 +1699,164 @@ class EPOnlineCondorJob(CondorJob, object):
         self.set_log_file(self.log_path)
 
         cfg_file = os.path.join(self.iwd, "%s_%s_config.ini" % (self.instrument, self.channel))
-        self.write_config_file(cfg_file)
-        # Reset the path so the submit file knows where to go
-        self.set_config_file(cfg_file)
+        written = self.write_config_file(cfg_file)
+        # The configuration in memory is what was written, so only the path
+        # the submit file refers to changes
+        self.add_opt("initialization-file", self.configuration_file)
 
         self.sub_file = os.path.join(self.iwd, "%s_%s_submit.sub" % (self.instrument, self.channel))
         self.set_sub_file(self.sub_file)
-        self.write_sub_file()
+        return written + write_sub_file_if_changed(self)
+
+#
+# Channel bundling
+#
+
+# Default budget for a bundle of channels, and the largest ratio of sample
+# rates within a bundle
+BUNDLE_MAX_CPUS = 4
+BUNDLE_MAX_MEMORY = 8192  # MB
+BUNDLE_RATE_RATIO = 4
+
+def _bundle_key(mngr, rate_ratio):
+    """
+    Channels can only share a job if they come from the same instrument and data source, are gated by the same data quality channel and bits, and have similar sample rates.
+    """
+    rate = mngr.downsample_rate or mngr.sample_rate
+    rate_band = int(math.floor(math.log(rate, rate_ratio))) if rate_ratio > 1 else rate
+    return (mngr.instrument, getattr(mngr, "shm_part_name", None), getattr(mngr, "frame_cache", None), getattr(mngr, "dq_channel", None), getattr(mngr, "on_bits", None), getattr(mngr, "off_bits", None), rate_band)
+
+def bundle_channels(managers, max_cpus=BUNDLE_MAX_CPUS, max_memory=BUNDLE_MAX_MEMORY, rate_ratio=BUNDLE_RATE_RATIO):
+    """
+    Pack channels (job class instances) into bundles which can run in one job. Channels are grouped by instrument, data source, data quality gating and sample rate (rates within a factor of rate_ratio), then each group is packed, largest first, into as few bundles as fit within max_cpus and max_memory (see estimate_bundle_resources). A channel which exceeds the budget by itself gets its own bundle. Returns a list of lists of channels.
+    """
+    groups = OrderedDict()
+    for mngr in managers:
+        groups.setdefault(_bundle_key(mngr, rate_ratio), []).append(mngr)
+
+    bundles = []
+    for group in groups.values():
+        # First fit decreasing
+        group = sorted(group, key=lambda m: predict_usage(m.cfg, m.downsample_rate or m.sample_rate)[1], reverse=True)
+        packed = []
+        for mngr in group:
+            for bundle in packed:
+                ncpu, mem_req = estimate_bundle_resources(bundle + [mngr])
+                if ncpu <= max_cpus and mem_req <= max_memory:
+                    bundle.append(mngr)
+                    break
+            else:
+                packed.append([mngr])
+        bundles.extend(packed)
+    return bundles
+
+class EPOnlineBundleCondorJob(CondorJob, object):
+    """
+    Class representing an online job which analyzes several channels (EPOnlineCondorJob instances from bundle_channels) in one condor job. gstlal_excesspower only analyzes one channel per instrument and takes one excesspower configuration, so the job runs ep_bundle, which starts one gstlal_excesspower per channel, each with its own configuration, and stops them all together. This saves the scheduler entries and slots of running them separately. The job is driven by a bundle configuration in the subsystem configuration format, with one section per channel pointing to its excesspower configuration.
+    """
+    @classmethod
+    def from_bundle_config(cls, config_file, rootdir):
+        """
+        Recreate a bundle from the bundle configuration it wrote.
+        """
+        cfgp = ConfigParser()
+        if cfgp.read(config_file) == []:
+            raise ValueError("No configuration files read.")
+        return EPOnlineBundleCondorJob([EPOnlineCondorJob.from_config_section(cfgp, sec, rootdir) for sec in cfgp.sections()], rootdir)
+
+    def __init__(self, managers, rootdir):
+        super(EPOnlineBundleCondorJob, self).__init__(universe="vanilla", executable=which("ep_bundle"), queue=1)
+
+        self.managers = sorted(managers, key=EPOnlineCondorJob.full_name)
+        self.instrument = self.managers[0].instrument
+        if any(m.instrument != self.instrument for m in self.managers):
+            raise ValueError("Channels in a bundle must come from the same instrument")
+
+        # The name only depends on the channels, so that the same bundle
+        # gets the same working directory
+        names = ",".join(m.full_name() for m in self.managers)
+        self.subsys = "BUNDLE"
+        self.channel = "BUNDLE_%s" % hashlib.sha1(names).hexdigest()[:10]
+
+        self.root_dir = rootdir
+
+        self.ncpu, self.mem_req = estimate_bundle_resources(self.managers)
+        self.add_condor_cmd("request_cpus", str(self.ncpu))
+        self.add_condor_cmd("request_memory", str(self.mem_req))
+
+        for incant, val in ONLINE_INCANTATION.iteritems():
+            self.add_condor_cmd(incant, val)
+        self.add_condor_cmd("environment", "GST_DEBUG=2")
+        self.add_condor_cmd("want_graceful_removal", "True")
+        self.add_condor_cmd("kill_sig", "15")
+
+        # The pipeline of each channel is run with the options of its own
+        # job, from the bundle configuration
+        self.add_opt("verbose", "")
+
+        self.configuration_file = None
+        self.out_log_path = None
+        self.err_log_path = None
+        self.log_path = None
+        self.iwd = None
+
+    def full_name(self):
+        """
+        Get the 'fully qualified' name of the bundle.
+        """
+        return "%s:%s" % (self.instrument, self.channel)
+
+    def channel_names(self):
+        """
+        Get the 'fully qualified' names of the channels in the bundle.
+        """
+        return [m.full_name() for m in self.managers]
+
+    def condor_status(self, attrs=None):
+        return OrderedDict([ (k, getattr(self, k)) for k in ['ncpu', 'mem_req', 'root_dir', 'iwd', 'log_path', 'err_log_path', 'out_log_path']])
+
+    def do_getenv(self):
+        """
+        Pull in user environment. Useful for running EP from non-system releases.
+        """
+        self.add_condor_cmd("getenv", "True")
+
+    def get_wd(self):
+        """
+        Get the base directory for this job.
+        """
+        return os.path.join(os.path.abspath(self.root_dir), self.instrument, self.subsys, self.channel)
+
+    def finalize(self):
+        """
+        Create directory structure, and write out the configuration of each channel, the bundle configuration (which refers to them), and the submit file.
+        """
+        self.iwd = self.get_wd()
+        self.add_condor_cmd("iwd", self.iwd)
+        makedirs(self.iwd)
+
+        log_path = os.path.join(self.iwd, "logs")
+        makedirs(log_path)
+
+        self.out_log_path = os.path.join(log_path, "%s_%s_output-$(Cluster).out" % (self.instrument, self.channel))
+        self.set_stdout_file(self.out_log_path)
+        self.err_log_path = os.path.join(log_path, "%s_%s_error-$(Cluster).err" % (self.instrument, self.channel))
+        self.set_stderr_file(self.err_log_path)
+        self.log_path = os.path.join(log_path, "%s_%s_log-$(Cluster).log" % (self.instrument, self.channel))
+        self.set_log_file(self.log_path)
+
+        written = 0
+        for mngr in self.managers:
+            written += mngr.write_config_file(os.path.join(self.iwd, "%s_%s_config.ini" % (mngr.instrument, mngr.channel)))
+
+        self.configuration_file = os.path.join(self.iwd, "%s_%s_bundle.ini" % (self.instrument, self.channel))
+        written += write_subsystem_config(self.managers, self.configuration_file, append=False)
+        self.add_opt("bundle-config", self.configuration_file)
+        self.add_opt("log-directory", log_path)
+
+        self.sub_file = os.path.join(self.iwd, "%s_%s_submit.sub" % (self.instrument, self.channel))
+        self.set_sub_file(self.sub_file)
+        return written + write_sub_file_if_changed(self)
 
 def write_all_configs(managers, working_dir="./", append=True):
     def categorize(mngr):
@@ -951,8 +1865,7 @@ def write_all_configs(managers, working_dir="./", append=True):
     written_configs = []
     for (inst, subsys), mlist in itertools.groupby(sorted(managers, key=EPOnlineCondorJob.full_name), categorize):
         inst_dir = os.path.join(working_dir, inst)
-        if not os.path.exists(inst_dir):
-            os.makedirs(inst_dir)
+        makedirs(inst_dir)
         cfg_fname = os.path.join(inst_dir, "%s_channels.ini" % subsys.lower())
         write_subsystem_config(mlist, cfg_fname, append)
         written_configs.append(cfg_fname)
@@ -961,13 +1874,20 @@ def write_all_configs(managers, working_dir="./", append=True):
             
 
 def write_subsystem_config(managers, path, append=True):
+    """
+    Write the sections of managers to the subsystem configuration path (a file name or an open file). If append is set, the other channels already in the file are kept, and the sections of managers replace their own in place.
+    """
     cfgp = ConfigParser()
-    if append:
-        with open(path, "r") as cfgf:
-            cfgp.read(cfgf)
+    if append and not hasattr(path, "write"):
+        # Nothing to keep from a file which does not exist yet
+        cfgp.read(path)
     for mngr in managers:
         sec = mngr.full_name()
-        cfgp.add_section(sec)
+        if cfgp.has_section(sec):
+            for opt in cfgp.options(sec):
+                cfgp.remove_option(sec, opt)
+        else:
+            cfgp.add_section(sec)
         #for a in ["instrument", "sample_rate", "configuration_file", "dq_channel", "on_bits", "off_bits", "priority"]:
         for a in ["instrument", "sample_rate", "downsample_rate", "configuration_file", "dq_channel", "on_bits", "off_bits", "shm_part_name"]:#, "priority"]:
             val = getattr(mngr, a)
@@ -977,46 +1897,467 @@ def write_subsystem_config(managers, path, append=True):
         cfgp.write(path)
         return
 
-    with open(path, "w") as fout:
-        cfgp.write(fout)
+    cfg = StringIO()
+    cfgp.write(cfg)
+    return write_if_changed(path, cfg.getvalue())
 
-def submit_condor_job(job):
-    cmd = shlex.split("/usr/bin/condor_submit %s" % job.sub_file)
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = proc.communicate()
-    # FIXME: This would be so much easier if condor did anything but
-    # print to the screen
-    cpid = -1
-    if proc.returncode == 0:
-        cpid = int(out.split("\n")[1].split()[-1][:-1])
-        pidfile = os.path.join(job.iwd, "condor.pid")
-        with open(pidfile, "w") as pidf:
-            print >>pidf, cpid
-    else:
-        print >>sys.stderr, "Failed to submit condor job (got status %d). Stderr follows:\n%s" % (proc.returncode, err)
+#
+# Scheduler backends
+#
 
-    return proc.returncode, cpid
+try:
+    import htcondor
+except ImportError:
+    # Fall back to the command line tools
+    htcondor = None
 
-def kill_condor_job(job, pid=None):
-    if pid is None:
-        pidf = os.path.join(job.get_wd(), "condor.pid")
-        if not os.path.exists(pidf):
-            raise IOError("No condor PID lockfile exists.")
+# Names of the condor JobStatus codes
+JOB_STATES = {1: "Idle", 2: "Running", 3: "Removed", 4: "Completed", 5: "Held", 6: "Transferring Output", 7: "Suspended"}
+
+# The user log events which change the state of a job
+_LOG_EVENT_STATES = {"000": "Idle", "001": "Running", "004": "Idle", "005": "Completed", "009": "Removed", "010": "Suspended", "011": "Running", "012": "Held", "013": "Idle"}
+
+def read_submit_file(sub_file):
+    """
+    Read a submit file written by the job classes into a dictionary of submit commands and the number of jobs to queue.
+    """
+    desc, count = OrderedDict(), 1
+    with open(sub_file) as subf:
+        for line in subf:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.lower().startswith("queue"):
+                tokens = line.split()
+                count = int(tokens[1]) if len(tokens) > 1 else 1
+                continue
+            key, val = line.split("=", 1)
+            desc[key.strip()] = val.strip()
+    return desc, count
+
+class JobLogFollower(object):
+    """
+    Follows condor user logs, reading only what has been appended since the last refresh, to keep the state of the jobs they record.
+    """
+    def __init__(self):
+        self.offsets = {}
+        self.states = {}
+
+    def refresh(self, log_file):
+        """
+        Read the new events in log_file and update the job states. Returns the states of the clusters in the log.
+        """
+        if not os.path.exists(log_file):
+            return {}
+        clusters = {}
+        with open(log_file) as logf:
+            logf.seek(self.offsets.get(log_file, 0))
+            while True:
+                line = logf.readline()
+                # Only consume complete lines, the rest of the event may
+                # not have been written yet
+                if not line.endswith("\n"):
+                    break
+                self.offsets[log_file] = logf.tell()
+                m = _log_event_re.match(line)
+                if m is None or m.group(1) not in _LOG_EVENT_STATES:
+                    continue
+                cluster = int(m.group(2).split(".")[0])
+                self.states[cluster] = _LOG_EVENT_STATES[m.group(1)]
+                clusters[cluster] = self.states[cluster]
+        return clusters
+
+class SchedulerBackend(object):
+    """
+    Interface to a batch scheduler. Jobs are job class instances which have been finalized (so their submit files exist), and are identified to the scheduler by cluster ID.
+    """
+    def submit(self, jobs):
+        """
+        Submit jobs, returning the cluster ID of each (or -1 if it could not be submitted).
+        """
+        raise NotImplementedError
+
+    def remove(self, cluster_ids):
+        """
+        Remove the jobs with cluster_ids, returning the IDs which were removed.
+        """
+        raise NotImplementedError
+
+    def status(self, cluster_ids=None):
+        """
+        Get the state (see JOB_STATES) of the jobs with cluster_ids, or all of the user's jobs if not given, as a dictionary keyed by cluster ID.
+        """
+        raise NotImplementedError
+
+class CondorBackend(SchedulerBackend):
+    """
+    Scheduler backend for condor. Uses the htcondor python bindings if they are available, so that many jobs are submitted in one schedd transaction and removed in one action. Otherwise, condor_submit is run for each job and condor_rm once for all of them. Job states come from following the jobs' user logs when those are known, and the schedd otherwise.
+    """
+    def __init__(self, schedd=None):
+        self.schedd = schedd
+        if self.schedd is None and htcondor is not None:
+            self.schedd = htcondor.Schedd()
+        self.log_follower = JobLogFollower()
+        # User log of each submitted cluster
+        self.logs = {}
+
+    def _log_file(self, job, cluster_id):
+        log_file = getattr(job, "log_path", None)
+        if log_file is None:
+            return None
+        return log_file.replace("$(Cluster)", str(cluster_id))
+
+    def submit(self, jobs):
+        cluster_ids = []
+        if self.schedd is not None:
+            with self.schedd.transaction() as txn:
+                for job in jobs:
+                    desc, count = read_submit_file(job.get_sub_file())
+                    cluster_ids.append(htcondor.Submit(dict(desc)).queue(txn, count))
         else:
-            with open(pidf) as f:
-                pid = int(f.read())
-
-    cmd = shlex.split("/usr/bin/condor_rm %s" % pid)
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = proc.communicate()
-    # FIXME: This would be so much easier if condor did anything but
-    # print to the screen
-    if proc.returncode != 0:
-        print >>sys.stderr, "Failed to kill condor job (got status %d). Stderr follows:\n%s" % (proc.returncode, err)
-    else:
-        os.unlink(pidf)
+            for job in jobs:
+                cluster_ids.append(self._condor_submit(job.get_sub_file()))
+
+        for job, cid in zip(jobs, cluster_ids):
+            if cid >= 0 and self._log_file(job, cid) is not None:
+                self.logs[cid] = self._log_file(job, cid)
+        return cluster_ids
+
+    def _condor_submit(self, sub_file):
+        proc = subprocess.Popen([which("condor_submit") or "/usr/bin/condor_submit", sub_file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        m = re.search(r"submitted to cluster (\d+)", out)
+        if proc.returncode != 0 or m is None:
+            print >>sys.stderr, "Failed to submit condor job (got status %d). Stderr follows:\n%s" % (proc.returncode, err)
+            return -1
+        return int(m.group(1))
+
+    def remove(self, cluster_ids):
+        cluster_ids = list(cluster_ids)
+        if not cluster_ids:
+            return []
+        if self.schedd is not None:
+            constraint = " || ".join("ClusterId == %d" % cid for cid in cluster_ids)
+            self.schedd.act(htcondor.JobAction.Remove, constraint)
+            return cluster_ids
+
+        proc = subprocess.Popen([which("condor_rm") or "/usr/bin/condor_rm"] + map(str, cluster_ids), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            print >>sys.stderr, "Failed to remove condor jobs (got status %d). Stderr follows:\n%s" % (proc.returncode, err)
+            return []
+        return cluster_ids
+
+    def track(self, job, cluster_id):
+        """
+        Follow the user log of a job submitted earlier (e.g. by another process) for its status.
+        """
+        log_file = self._log_file(job, cluster_id)
+        if log_file is not None:
+            self.logs[cluster_id] = log_file
+
+    def status(self, cluster_ids=None):
+        states, untracked = {}, []
+        for cid in (cluster_ids if cluster_ids is not None else self.logs.keys()):
+            if cid in self.logs and os.path.exists(self.logs[cid]):
+                self.log_follower.refresh(self.logs[cid])
+                states[cid] = self.log_follower.states.get(cid, "Idle")
+            else:
+                untracked.append(cid)
+
+        if untracked or cluster_ids is None:
+            constraint = "Owner == \"%s\"" % os.environ["USER"]
+            if cluster_ids is not None:
+                constraint = " || ".join("ClusterId == %d" % cid for cid in untracked)
+            for cid, state in self._query(constraint):
+                states.setdefault(cid, JOB_STATES.get(state, str(state)))
+        return states
+
+    def _query(self, constraint):
+        if self.schedd is not None:
+            return [(ad["ClusterId"], ad["JobStatus"]) for ad in self.schedd.query(constraint, ["ClusterId", "JobStatus"])]
+        proc = subprocess.Popen([which("condor_q") or "/usr/bin/condor_q", "-constraint", constraint, "-af", "ClusterId", "JobStatus"], stdout=subprocess.PIPE)
+        out = proc.communicate()[0]
+        return [tuple(map(int, line.split())) for line in out.splitlines() if line.strip()]
+
+class FakeScheduler(SchedulerBackend):
+    """
+    A scheduler which only keeps its jobs in memory, for testing without condor. Submitted jobs are Idle until they are given another state with set_state.
+    """
+    def __init__(self, first_cluster_id=1):
+        self.next_cluster_id = first_cluster_id
+        self.jobs = OrderedDict()
+        self.states = {}
+
+    def submit(self, jobs):
+        cluster_ids = []
+        for job in jobs:
+            # Like condor, refuse what can't be read
+            read_submit_file(job.get_sub_file())
+            cid = self.next_cluster_id
+            self.next_cluster_id += 1
+            self.jobs[cid] = job
+            self.states[cid] = "Idle"
+            cluster_ids.append(cid)
+        return cluster_ids
+
+    def remove(self, cluster_ids):
+        removed = [cid for cid in cluster_ids if self.states.get(cid) not in (None, "Removed", "Completed")]
+        for cid in removed:
+            self.states[cid] = "Removed"
+        return removed
+
+    def set_state(self, cluster_id, state):
+        self.states[cluster_id] = state
+
+    def status(self, cluster_ids=None):
+        if cluster_ids is None:
+            return dict(self.states)
+        return dict((cid, self.states[cid]) for cid in cluster_ids if cid in self.states)
+
+_scheduler = None
+
+def get_scheduler():
+    """
+    Get the scheduler backend used by the job management functions, a CondorBackend unless set_scheduler was called.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = CondorBackend()
+    return _scheduler
 
-    return proc.returncode
+def set_scheduler(backend):
+    """
+    Set the scheduler backend used by the job management functions (e.g. a FakeScheduler for testing).
+    """
+    global _scheduler
+    _scheduler = backend
+
+#
+# Job state store
+#
+
+# Name of the job state database, in the root directory of the jobs
+JOB_STATE_DB = "ep_jobs.sqlite"
+
+# Seconds to wait for another process to finish writing to the store
+JOB_STATE_TIMEOUT = 60
+
+# States in which a job no longer has a live cluster
+FINISHED_STATES = ("Removed", "Completed")
+
+class JobStateStore(object):
+    """
+    A SQLite database of the cluster ID, submission time, configuration hash and last known state of each job (by full_name()) under a root directory. The channels of a bundle (EPOnlineBundleCondorJob) are recorded as well, with the cluster ID of the bundle and its name, so that they are seen as running. Lookups for any number of jobs are a single indexed query, and writes happen in immediate transactions, so several ep_manager processes can use the store at once.
+    """
+    # SQLite limits the number of parameters in a statement
+    CHUNK = 500
+    COLUMNS = ("name", "cluster_id", "submit_time", "config_hash", "status", "updated", "wd", "bundle")
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=JOB_STATE_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            name TEXT PRIMARY KEY,
+            cluster_id INTEGER,
+            submit_time REAL,
+            config_hash TEXT,
+            status TEXT,
+            updated REAL,
+            wd TEXT,
+            bundle TEXT)""")
+        # Stores written before bundles were recorded
+        if "bundle" not in [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN bundle TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_cluster_id ON jobs (cluster_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_bundle ON jobs (bundle)")
+
+    def _write(self, sql, rows):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(sql, rows)
+            self.conn.execute("COMMIT")
+        except:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def record_submit(self, jobs, cluster_ids, submit_time=None):
+        """
+        Record that jobs were submitted with cluster_ids. The channels of bundles are recorded with the cluster ID of their bundle.
+        """
+        submit_time = submit_time or time.time()
+        rows = []
+        for job, cid in zip(jobs, cluster_ids):
+            if cid < 0:
+                continue
+            rows.append((job.full_name(), cid, submit_time, job_file_hash(job), "Idle", submit_time, job.get_wd(), None))
+            for mngr in getattr(job, "managers", []):
+                rows.append((mngr.full_name(), cid, submit_time, job_file_hash(mngr), "Idle", submit_time, mngr.get_wd(), job.full_name()))
+        self._write("INSERT OR REPLACE INTO jobs (%s) VALUES (%s)" % (", ".join(self.COLUMNS), ", ".join("?"*len(self.COLUMNS))), rows)
+
+    def update_status(self, states):
+        """
+        Record the states of jobs, given as a dictionary keyed by name. The state of a bundle is also that of its channels.
+        """
+        now = time.time()
+        self._write("UPDATE jobs SET status = ?, updated = ? WHERE name = ? OR bundle = ?", [(state, now, name, name) for name, state in states.iteritems()])
+
+    def get(self, names):
+        """
+        Get the records of the named jobs which are in the store, as a dictionary keyed by name.
+        """
+        names, records = list(names), {}
+        for i in range(0, len(names), self.CHUNK):
+            chunk = names[i:i+self.CHUNK]
+            cur = self.conn.execute("SELECT %s FROM jobs WHERE name IN (%s)" % (", ".join(self.COLUMNS), ",".join("?"*len(chunk))), chunk)
+            for row in cur:
+                records[row[0]] = dict(zip(self.COLUMNS, row))
+        return records
+
+    def jobs(self, status=None):
+        """
+        Get the records of all jobs, or those in status.
+        """
+        sql = "SELECT %s FROM jobs" % ", ".join(self.COLUMNS)
+        cur = self.conn.execute(sql + " WHERE status = ?", (status,)) if status else self.conn.execute(sql)
+        return [dict(zip(self.COLUMNS, row)) for row in cur]
+
+_state_stores = {}
+
+def get_state_store(root_dir):
+    """
+    Get the job state store for the jobs under root_dir.
+    """
+    path = os.path.join(os.path.abspath(root_dir), JOB_STATE_DB)
+    if path not in _state_stores:
+        makedirs(os.path.dirname(path))
+        _state_stores[path] = JobStateStore(path)
+    return _state_stores[path]
+
+def job_file_hash(job):
+    """
+    Hash the configuration and submit files of a finalized job, to tell whether what is running is what is configured.
+    """
+    digest = hashlib.sha1()
+    for path in (getattr(job, "configuration_file", None), job.get_sub_file()):
+        if path and os.path.exists(path):
+            with open(path) as fin:
+                digest.update(fin.read())
+    return digest.hexdigest()
+
+def _group_by_store(jobs):
+    groups = OrderedDict()
+    for job in jobs:
+        groups.setdefault(get_state_store(job.root_dir), []).append(job)
+    return groups.items()
+
+def read_condor_pids(jobs):
+    """
+    Get the cluster ID of the live condor job of each job, or None if it has none. Jobs submitted before the state store existed are found through their condor.pid files.
+    """
+    pids = {}
+    for store, sjobs in _group_by_store(jobs):
+        records = store.get(job.full_name() for job in sjobs)
+        for job in sjobs:
+            rec = records.get(job.full_name())
+            if rec is not None:
+                pids[job] = rec["cluster_id"] if rec["status"] not in FINISHED_STATES else None
+                continue
+            pidf = os.path.join(job.get_wd(), "condor.pid")
+            if os.path.exists(pidf):
+                with open(pidf) as f:
+                    pids[job] = int(f.read())
+            else:
+                pids[job] = None
+    return [pids[job] for job in jobs]
+
+def read_job_bundles(jobs):
+    """
+    Get the name of the bundle each job was last started in, or None if it was started on its own (or never).
+    """
+    bundles = {}
+    for store, sjobs in _group_by_store(jobs):
+        records = store.get(job.full_name() for job in sjobs)
+        for job in sjobs:
+            bundles[job] = records.get(job.full_name(), {}).get("bundle")
+    return [bundles[job] for job in jobs]
+
+def read_condor_pid(job):
+    """
+    Get the cluster ID of the live condor job of a job, or None, see read_condor_pids.
+    """
+    return read_condor_pids([job])[0]
+
+def submit_condor_jobs(jobs):
+    """
+    Submit finalized jobs to the scheduler in one batch, recording the cluster ID of each in the state store of their root directory. Returns the cluster ID of each job, -1 where submission failed.
+    """
+    cluster_ids = dict(zip(jobs, get_scheduler().submit(jobs)))
+    for store, sjobs in _group_by_store(jobs):
+        store.record_submit(sjobs, [cluster_ids[job] for job in sjobs])
+    return [cluster_ids[job] for job in jobs]
+
+def kill_condor_jobs(jobs):
+    """
+    Remove jobs from the scheduler in one batch, using the cluster IDs recorded when they were submitted. Returns the jobs which were removed.
+    """
+    pids = dict(zip(jobs, read_condor_pids(jobs)))
+    missing = [job for job, pid in pids.iteritems() if pid is None]
+    if missing:
+        raise IOError("No condor job recorded for %s." % ", ".join(job.full_name() for job in missing))
+
+    removed = set(get_scheduler().remove(pids.values()))
+    killed = [job for job in jobs if pids[job] in removed]
+    for store, sjobs in _group_by_store(killed):
+        # Removing a channel of a bundle removes the whole bundle
+        names = [job.full_name() for job in sjobs] + filter(None, read_job_bundles(sjobs))
+        store.update_status(dict((name, "Removed") for name in names))
+    for job in killed:
+        # Left by versions before the state store
+        pidf = os.path.join(job.get_wd(), "condor.pid")
+        if os.path.exists(pidf):
+            os.unlink(pidf)
+    return killed
+
+def condor_job_states(jobs):
+    """
+    Get the scheduler state of each job (None if it has no live condor job), with one status query for all of them. The states are recorded in the state store.
+    """
+    scheduler = get_scheduler()
+    pids = read_condor_pids(jobs)
+    if hasattr(scheduler, "track"):
+        for job, pid in zip(jobs, pids):
+            if pid is not None:
+                scheduler.track(job, pid)
+    states = scheduler.status([pid for pid in pids if pid is not None])
+    job_states = [pid is not None and states.get(pid, "Unknown") or None for pid in pids]
+
+    state_of = dict(zip(jobs, job_states))
+    for store, sjobs in _group_by_store([job for job in jobs if state_of[job] is not None]):
+        store.update_status(dict((job.full_name(), state_of[job]) for job in sjobs))
+    return job_states
+
+def live_job_states(jobs):
+    """
+    Get the scheduler state of each job, as condor_job_states, but None unless the job (or the bundle it was started in) is still in the queue, so it should not be started again.
+    """
+    return [state if state not in FINISHED_STATES + ("Unknown",) else None for state in condor_job_states(jobs)]
+
+def submit_condor_job(job):
+    """
+    Submit a single finalized job, see submit_condor_jobs. Returns the status (0 on success) and the cluster ID.
+    """
+    cpid = submit_condor_jobs([job])[0]
+    return (0 if cpid >= 0 else 1), cpid
+
+def kill_condor_job(job, pid=None):
+    """
+    Remove a single job, see kill_condor_jobs. If pid is given, it is removed instead of the recorded cluster ID of job. Returns the status (0 on success).
+    """
+    if pid is not None:
+        return 0 if get_scheduler().remove([pid]) else 1
+    return 0 if kill_condor_jobs([job]) else 1
 
 def parse_condor_xml_node(node):
     job_stat = {}
@@ -1025,7 +2366,14 @@ def parse_condor_xml_node(node):
     return job_stat
 
 def get_condor_status(user=None):
-    cmd = shlex.split("/usr/bin/condor_q -xml %s" % os.environ["USER"])
+    """
+    Get the class ads of the user's jobs (the current user if not given) as a list of dictionaries. Uses the htcondor bindings if they are available, and parses condor_q -xml otherwise.
+    """
+    user = user or os.environ["USER"]
+    if htcondor is not None:
+        return [dict(ad) for ad in htcondor.Schedd().query("Owner == \"%s\"" % user)]
+
+    cmd = shlex.split("/usr/bin/condor_q -xml %s" % user)
     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
     xml = proc.communicate()[0]
     
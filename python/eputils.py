@@ -1,5 +1,16 @@
+import re
+import os
+import heapq
+import bisect
+import gzip
+import sqlite3
+from StringIO import StringIO
+from xml.sax import saxutils
+
+import numpy
+
 from glue.ligolw import param, ligolw
-from glue.ligolw import utils, table, lsctables
+from glue.ligolw import utils, table, lsctables, ilwd, tokenizer
 
 from pylal.series import read_psd_xmldoc
 from pylal.series import build_COMPLEX16FrequencySeries
@@ -64,3 +75,602 @@ def read_tseries_xmldoc(xmldoc):
 		if len(result[instrument].data) == 0: 
 			result[instrument] = None 
 	return result
+
+#
+# Columnar (numpy structured array) tables
+#
+
+# numpy types of the LIGO_LW column types. ilwd:char IDs are kept as their
+# integer part, and strings as fixed width byte strings (see read_table_array)
+LIGOLW_NUMPY_TYPES = {
+	u"real_4": numpy.float32,
+	u"real_8": numpy.float64,
+	u"float": numpy.float32,
+	u"double": numpy.float64,
+	u"int_2s": numpy.int16,
+	u"int_2u": numpy.uint16,
+	u"int_4s": numpy.int32,
+	u"int_4u": numpy.uint32,
+	u"int_8s": numpy.int64,
+	u"int_8u": numpy.uint64,
+	u"ilwd:char": numpy.int64,
+	u"ilwd:char_u": numpy.int64,
+	u"lstring": str,
+	u"string": str,
+	u"char_s": str,
+	u"char_v": str
+}
+
+_table_re = re.compile(r'<Table\s[^>]*Name="([^"]*)"')
+_column_re = re.compile(r'<Column\s[^>]*>')
+_name_re = re.compile(r'\sName="([^"]*)"')
+_type_re = re.compile(r'\sType="([^"]*)"')
+_stream_re = re.compile(r'<Stream\s[^>]*>')
+_delimiter_re = re.compile(r'\sDelimiter="([^"]*)"')
+
+# Entities which may appear in a stream, besides those saxutils.unescape
+# always replaces
+_xml_entities = {"&quot;": '"', "&apos;": "'"}
+
+def _strip_table_name(name):
+	name = name.split(u":")
+	if len(name) > 1 and name[-1] == u"table":
+		return name[-2]
+	return name[-1]
+
+def _columns_to_array(columns, names, types):
+	"""
+	Turn columns (sequences of tokens, as the stream tokenizer gives them) into one structured array, with the given column names and LIGO_LW types.
+	"""
+	arrays = []
+	for name, ltype, tokens in zip(names, types, columns):
+		nptype = LIGOLW_NUMPY_TYPES.get(ltype)
+		if nptype is str:
+			arrays.append(numpy.array([t or "" for t in tokens], dtype=str))
+		elif ltype.startswith(u"ilwd:char"):
+			arrays.append(numpy.array([t and t.rsplit(":", 1)[-1] or 0 for t in tokens], dtype=nptype))
+		elif nptype in (numpy.float32, numpy.float64):
+			arrays.append(numpy.array([t or "nan" for t in tokens], dtype=nptype))
+		elif nptype is not None:
+			arrays.append(numpy.array([t or 0 for t in tokens], dtype=nptype))
+		else:
+			arrays.append(numpy.array(tokens, dtype=object))
+	dtype = [(str(name), a.dtype) for name, a in zip(names, arrays)]
+	out = numpy.empty(len(arrays[0]) if arrays else 0, dtype=dtype)
+	for name, a in zip(names, arrays):
+		out[str(name)] = a
+	return out
+
+def read_table_array(filename, tablename, columns=None, block_size=65536):
+	"""
+	Read the table tablename (e.g. sngl_burst or sim_burst) from the LIGO_LW XML document in filename (gzipped if it ends in .gz) directly into a numpy structured array, without building a glue row object for each row. columns limits the columns kept, in that order (default is all of them, in the order of the document). ilwd:char IDs are turned into their integer part, null floats become nan and null integers 0, and strings become fixed width byte strings. The stream is split into tokens by the glue ligolw tokenizer, as glue reads it, so rows may be laid out in any way, and tokens of columns which are not kept are dropped by the tokenizer; they are converted block_size rows at a time. The Table, Column and Stream start tags must each be on one line.
+
+	See also write_table_array.
+	"""
+	if filename.endswith(".gz"):
+		xmlfile = gzip.open(filename)
+	else:
+		xmlfile = open(filename)
+	tablename = _strip_table_name(tablename)
+
+	names, types, blocks, tokens = [], [], [], []
+	kept, tok, delimiter = [], None, None
+	found = False
+	with xmlfile:
+		for line in xmlfile:
+			if tok is None:
+				if not found:
+					match = _table_re.search(line)
+					if match is None or _strip_table_name(match.group(1)) != tablename:
+						continue
+					found = True
+					line = line[match.end():]
+
+				for match in _column_re.finditer(line):
+					names.append(_name_re.search(match.group(0)).group(1).split(u":")[-1])
+					types.append(_type_re.search(match.group(0)).group(1))
+				match = _stream_re.search(line)
+				if match is None:
+					continue
+
+				if columns is not None:
+					missing = set(columns) - set(names)
+					if missing:
+						raise ValueError("No column(s) %s in the %s table of %s" % (", ".join(sorted(missing)), tablename, filename))
+				kept = [i for i, name in enumerate(names) if columns is None or name in columns]
+				delimiter = _delimiter_re.search(match.group(0))
+				delimiter = delimiter and unicode(delimiter.group(1)) or u","
+				tok = tokenizer.Tokenizer(delimiter)
+				tok.set_types([unicode if i in kept else None for i in range(len(names))])
+				line = line[match.end():]
+
+			# In the stream. Entities never span lines
+			end = line.find("</Stream>")
+			if end >= 0:
+				line = line[:end]
+			tokens.extend(tok.append(saxutils.unescape(line.decode("utf-8"), _xml_entities)))
+			if end >= 0:
+				# The tokenizer only ends a token at a delimiter
+				tokens.extend(tok.append(delimiter))
+			if kept and len(tokens) >= block_size * len(kept):
+				n = len(tokens) // len(kept) * len(kept)
+				blocks.append(_columns_to_array([tokens[i:n:len(kept)] for i in range(len(kept))], [names[i] for i in kept], [types[i] for i in kept]))
+				del tokens[:n]
+			if end >= 0:
+				break
+
+	if not found:
+		raise ValueError("No %s table found in %s" % (tablename, filename))
+	if kept and len(tokens) % len(kept):
+		raise ValueError("The %s table of %s ends in an incomplete row" % (tablename, filename))
+	if tokens or not blocks:
+		blocks.append(_columns_to_array([tokens[i::len(kept)] for i in range(len(kept))], [names[i] for i in kept], [types[i] for i in kept]))
+	if len(blocks) == 1:
+		arr = blocks[0]
+	else:
+		# Strings may be wider in later blocks
+		dtype = [(n, max([b.dtype[n] for b in blocks], key=lambda dt: dt.itemsize)) for n in blocks[0].dtype.names]
+		arr = numpy.concatenate([b.astype(dtype) for b in blocks])
+	if columns is not None and list(columns) != list(arr.dtype.names):
+		ordered = numpy.empty(len(arr), dtype=[(str(c), arr.dtype[str(c)]) for c in columns])
+		for c in columns:
+			ordered[str(c)] = arr[str(c)]
+		arr = ordered
+	return arr
+
+def _ilwd_table_name(tablename, column):
+	"""
+	Get the name of the table an ID column refers to: event_id and simulation_id are IDs of the table itself, and the others are named for their table (e.g. process_id, time_slide_id).
+	"""
+	if column in ("event_id", "simulation_id"):
+		return tablename
+	return column[:-len("_id")]
+
+def write_table_array(arr, tablename, xmldoc=None, filename=None):
+	"""
+	Turn the structured array arr (as returned by read_table_array) back into a lsctables table named tablename, with the columns of arr. Integer IDs are turned back into ilwd:char IDs (e.g. process:process_id:0). The table is appended to the LIGO_LW element of xmldoc, or a new document if xmldoc is None, and the document is written to filename if one is given. Returns the document.
+	"""
+	tablename = _strip_table_name(tablename)
+	tblcls = lsctables.TableByName[tablename]
+	names = arr.dtype.names
+	tbl = lsctables.New(tblcls, columns=list(names))
+
+	converters = []
+	for name in names:
+		ltype = tblcls.validcolumns.get(name)
+		if ltype is not None and ltype.startswith(u"ilwd:char"):
+			prefix = "%s:%s:" % (_ilwd_table_name(tablename, name), name)
+			converters.append(lambda v, prefix=prefix: ilwd.ilwdchar("%s%d" % (prefix, v)))
+		elif arr.dtype[name].kind == "S":
+			converters.append(unicode)
+		elif arr.dtype[name].kind == "f":
+			converters.append(lambda v: None if numpy.isnan(v) else float(v))
+		else:
+			converters.append(lambda v: v.item())
+
+	for rec in arr:
+		row = tbl.RowType()
+		for name, conv, value in zip(names, converters, rec):
+			setattr(row, name, conv(value))
+		tbl.append(row)
+
+	if xmldoc is None:
+		xmldoc = ligolw.Document()
+		xmldoc.appendChild(ligolw.LIGO_LW())
+	xmldoc.childNodes[0].appendChild(tbl)
+	if filename is not None:
+		utils.write_filename(xmldoc, filename, gz=filename.endswith(".gz"))
+	return xmldoc
+
+def array_time(arr, prefix):
+	"""
+	Combine the integer seconds and nanoseconds columns prefix_time and prefix_time_ns (e.g. prefix = "peak") of a structured array into floating point GPS times.
+	"""
+	return arr["%s_time" % prefix] + 1e-9 * arr["%s_time_ns" % prefix]
+
+class TableArrayStream(object):
+	"""
+	Write a table to a LIGO_LW XML document (gzipped if filename ends in .gz) one structured array at a time, so the whole table never has to be held in memory. The arrays must have the dtype given here, as read_table_array returns it. The document is written under a temporary name and only moved to filename by close(), so an interrupted writer never leaves a document which looks complete.
+	"""
+	def __init__(self, filename, tablename, dtype):
+		self.filename = filename
+		self.tablename = _strip_table_name(tablename)
+		self.dtype = numpy.dtype(dtype)
+		self.nrows = 0
+
+		# Let glue write the document around an empty table
+		buf = StringIO()
+		utils.write_fileobj(write_table_array(numpy.empty(0, dtype=self.dtype), self.tablename), buf)
+		text = buf.getvalue()
+		stream = _stream_re.search(text)
+		self._tail = "\n" + text[text.index("</Stream>", stream.end()):]
+
+		# glue may order the columns differently from the dtype
+		self._order = [str(_name_re.search(match.group(0)).group(1).split(u":")[-1]) for match in _column_re.finditer(text[:stream.start()])]
+
+		tblcls = lsctables.TableByName[self.tablename]
+		self._formats = []
+		for name in self._order:
+			ltype = tblcls.validcolumns.get(name)
+			if ltype is not None and ltype.startswith(u"ilwd:char"):
+				prefix = "%s:%s:" % (_ilwd_table_name(self.tablename, name), name)
+				self._formats.append(lambda v, prefix=prefix: '"%s%d"' % (prefix, v))
+			elif self.dtype[name].kind == "S":
+				self._formats.append(lambda v: '"%s"' % v.replace("\\", "\\\\").replace('"', '\\"'))
+			elif self.dtype[name].kind == "f":
+				self._formats.append(lambda v: "" if numpy.isnan(v) else repr(float(v)))
+			else:
+				self._formats.append(str)
+
+		self._tmp_name = filename + ".tmp"
+		if filename.endswith(".gz"):
+			self._out = gzip.open(self._tmp_name, "wb")
+		else:
+			self._out = open(self._tmp_name, "w")
+		self._out.write(text[:stream.end()])
+
+	def write(self, arr):
+		"""
+		Append the rows of the structured array arr to the table.
+		"""
+		for rec in arr[self._order]:
+			if self.nrows:
+				self._out.write(",")
+			self._out.write("\n\t\t\t" + ",".join([fmt(v) for fmt, v in zip(self._formats, rec)]))
+			self.nrows += 1
+
+	def close(self, xmldoc=None):
+		"""
+		Finish the document and move it into place. The tables of xmldoc, if given, are written after the streamed table, so that those which describe the whole of it (e.g. the process and search_summary tables) can be filled in once it is complete.
+		"""
+		end = self._tail.rindex("</LIGO_LW>")
+		self._out.write(self._tail[:end])
+		if xmldoc is not None:
+			buf = StringIO()
+			for elem in xmldoc.childNodes[0].childNodes:
+				elem.write(buf, ligolw.Indent)
+			self._out.write(buf.getvalue().encode("utf-8"))
+		self._out.write(self._tail[end:])
+		self._out.close()
+		os.rename(self._tmp_name, self.filename)
+
+#
+# Streaming excesspower clustering
+#
+
+class _Cluster(object):
+	"""
+	A cluster of time-frequency tiles: its extent, relative to the epoch of the clusterer, and the sums which make up its SNR squared weighted peak.
+	"""
+	__slots__ = ("start", "end", "flow", "fhigh", "peak", "peak_frequency", "snr2", "amplitude", "confidence", "rec")
+
+class StreamingClusterer(object):
+	"""
+	Cluster sngl_burst tiles with the excesspower algorithm of ligolw_bucluster while they stream in, holding only the clusters which may still grow. Tiles of the same ifo, channel and search whose time and frequency extents both overlap are merged: the cluster spans both, its peak time and frequency are weighted by SNR squared, SNRs add in quadrature and amplitudes linearly, and it keeps the remaining columns (including the event_id) of its most confident tile. Two tiles with identical extents are not combined, the one with the larger SNR is kept. Merging is repeated until no two clusters overlap, which gives the same clusters as ligolw_bucluster, but across any number of files.
+
+	Tiles are given to add() as structured arrays from read_table_array, in any order, along with a watermark: a time before which none of the tiles still to come start. Clusters which end before the watermark and before the start of every other open cluster are complete, and are returned by add(). flush() returns the rest at the end of the stream.
+	"""
+	def __init__(self):
+		self.epoch = None
+		self.dtype = None
+		# Open clusters, by (ifo, channel, search)
+		self.active = {}
+
+	def _key(self, rec):
+		return tuple([rec[n] for n in ("ifo", "channel", "search") if n in self.dtype.names])
+
+	def add(self, arr, watermark):
+		"""
+		Cluster the tiles of arr, and return the clusters completed by the watermark as a structured array of the same dtype.
+		"""
+		if len(arr) and self.epoch is None:
+			self.epoch = int(arr["start_time"].min())
+		if len(arr):
+			# Strings may be wider in later arrays
+			self.dtype = numpy.dtype([(n, max([arr.dtype[n]] + ([self.dtype[n]] if self.dtype is not None else []), key=lambda dt: dt.itemsize)) for n in arr.dtype.names])
+
+		start = (arr["start_time"] - self.epoch) + 1e-9 * arr["start_time_ns"]
+		peak = (arr["peak_time"] - self.epoch) + 1e-9 * arr["peak_time_ns"]
+		tiles = {}
+		for i in numpy.argsort(start, kind="mergesort"):
+			rec = arr[i]
+			tile = _Cluster()
+			tile.start, tile.end = start[i], start[i] + rec["duration"]
+			tile.flow = rec["central_freq"] - rec["bandwidth"] / 2.0
+			tile.fhigh = rec["central_freq"] + rec["bandwidth"] / 2.0
+			tile.snr2 = float(rec["snr"])**2
+			tile.peak, tile.peak_frequency = peak[i] * tile.snr2, rec["peak_frequency"] * tile.snr2
+			tile.amplitude, tile.confidence = rec["amplitude"], rec["confidence"]
+			tile.rec = rec
+			tiles.setdefault(self._key(rec), []).append(tile)
+		for key, ktiles in tiles.iteritems():
+			self.active[key] = self._insert(self.active.get(key, []), ktiles)
+
+		if watermark is None or self.epoch is None:
+			return self._to_array([])
+		return self._to_array(self._complete(watermark - self.epoch))
+
+	def flush(self):
+		"""
+		Return all of the remaining clusters, at the end of the stream.
+		"""
+		done = [c for clusters in self.active.values() for c in clusters]
+		self.active = {}
+		return self._to_array(done)
+
+	def _insert(self, clusters, tiles):
+		"""
+		Merge tiles (in start order) into clusters, and return the new list of clusters. A cluster can only overlap a tile which starts before it ends, so clusters are kept in a heap by end time, and retired from the search once the tiles have moved past their end. Merging can extend a cluster back in time, so the retired clusters are kept in end order, and a merged cluster is also checked against those which end after it starts.
+		"""
+		def overlaps(c, tile):
+			return c.start < tile.end and tile.start < c.end and c.flow < tile.fhigh and tile.flow < c.fhigh
+
+		first = tiles[0].start
+		retired = sorted([c for c in clusters if c.end <= first], key=lambda c: c.end)
+		retired_ends = [c.end for c in retired]
+		live = set([c for c in clusters if c.end > first])
+		heap = [(c.end, id(c), c) for c in live]
+		heapq.heapify(heap)
+
+		for tile in tiles:
+			while heap and heap[0][0] <= tile.start:
+				end, _, c = heapq.heappop(heap)
+				if c in live:
+					live.remove(c)
+					i = bisect.bisect_right(retired_ends, end)
+					retired.insert(i, c)
+					retired_ends.insert(i, end)
+
+			# Merge the tile into every cluster it overlaps, then the
+			# result into any cluster it has grown to overlap, until there
+			# are none
+			while True:
+				found = [c for c in live if overlaps(c, tile)]
+				i = bisect.bisect_right(retired_ends, tile.start)
+				found_retired = [j for j in range(i, len(retired)) if overlaps(retired[j], tile)]
+				if not found and not found_retired:
+					break
+				for c in found:
+					live.remove(c)
+					tile = _merge(c, tile)
+				for j in reversed(found_retired):
+					tile = _merge(retired.pop(j), tile)
+					del retired_ends[j]
+			live.add(tile)
+			heapq.heappush(heap, (tile.end, id(tile), tile))
+
+		return list(live) + retired
+
+	def _complete(self, watermark):
+		# Only clusters which are not joined in time, through any chain of
+		# others, to a cluster reaching past the watermark can no longer grow
+		done = []
+		for key, clusters in self.active.items():
+			clusters.sort(key=lambda c: c.start)
+			groups, group_end = [], None
+			for c in clusters:
+				if group_end is None or c.start >= group_end:
+					groups.append([])
+					group_end = c.end
+				groups[-1].append(c)
+				group_end = max(group_end, c.end)
+			self.active[key] = []
+			for group in groups:
+				if max(c.end for c in group) <= watermark:
+					done.extend(group)
+				else:
+					self.active[key].extend(group)
+			if not self.active[key]:
+				del self.active[key]
+		return done
+
+	def _to_array(self, clusters):
+		if self.dtype is None:
+			return numpy.empty(0)
+		clusters = sorted(clusters, key=lambda c: c.start)
+		out = numpy.empty(len(clusters), dtype=self.dtype)
+		for i, c in enumerate(clusters):
+			out[i] = c.rec
+		if not clusters:
+			return out
+
+		def split(t):
+			sec = numpy.floor(t)
+			ns = numpy.round((t - sec) * 1e9).astype(numpy.int64)
+			sec = sec.astype(numpy.int64) + (ns >= 1000000000)
+			return self.epoch + sec, ns % 1000000000
+
+		start = numpy.array([c.start for c in clusters])
+		end = numpy.array([c.end for c in clusters])
+		flow = numpy.array([c.flow for c in clusters])
+		fhigh = numpy.array([c.fhigh for c in clusters])
+		snr2 = numpy.array([c.snr2 for c in clusters])
+		out["start_time"], out["start_time_ns"] = split(start)
+		out["duration"] = end - start
+		out["central_freq"] = (flow + fhigh) / 2.0
+		out["bandwidth"] = fhigh - flow
+		if "flow" in self.dtype.names:
+			out["flow"] = flow
+		if "fhigh" in self.dtype.names:
+			out["fhigh"] = fhigh
+		# A tile with no SNR has no weight, fall back to its own peak
+		weight = numpy.where(snr2 > 0, snr2, 1.0)
+		peak = numpy.array([c.peak if c.snr2 > 0 else c.start for c in clusters]) / weight
+		out["peak_time"], out["peak_time_ns"] = split(peak)
+		out["peak_frequency"] = numpy.array([c.peak_frequency if c.snr2 > 0 else (c.flow + c.fhigh) / 2.0 for c in clusters]) / weight
+		out["snr"] = numpy.sqrt(snr2)
+		out["amplitude"] = [c.amplitude for c in clusters]
+		out["confidence"] = [c.confidence for c in clusters]
+		return out
+
+def _merge(a, b):
+	"""
+	Merge two overlapping clusters (see StreamingClusterer).
+	"""
+	if (a.start, a.end, a.flow, a.fhigh) == (b.start, b.end, b.flow, b.fhigh):
+		return b if b.snr2 > a.snr2 else a
+	c = _Cluster()
+	c.start, c.end = min(a.start, b.start), max(a.end, b.end)
+	c.flow, c.fhigh = min(a.flow, b.flow), max(a.fhigh, b.fhigh)
+	c.peak, c.peak_frequency = a.peak + b.peak, a.peak_frequency + b.peak_frequency
+	c.snr2, c.amplitude = a.snr2 + b.snr2, a.amplitude + b.amplitude
+	best = b if b.confidence > a.confidence else a
+	c.confidence, c.rec = best.confidence, best.rec
+	return c
+
+#
+# Trigger store
+#
+
+# Columns of sngl_burst kept in a TriggerStore, besides ifo and channel
+TRIGGER_STORE_COLUMNS = (
+	("start_time", numpy.int32),
+	("start_time_ns", numpy.int32),
+	("duration", numpy.float32),
+	("peak_time", numpy.int32),
+	("peak_time_ns", numpy.int32),
+	("central_freq", numpy.float32),
+	("bandwidth", numpy.float32),
+	("peak_frequency", numpy.float32),
+	("amplitude", numpy.float32),
+	("snr", numpy.float32),
+	("confidence", numpy.float32),
+	("chisq", numpy.float64),
+	("chisq_dof", numpy.float64),
+	("tfvolume", numpy.float32)
+)
+
+class TriggerStore(object):
+	"""
+	A SQLite database of the sngl_burst triggers of any number of trigger files, for range queries by channel, peak time, central frequency and SNR which do not have to find or parse any XML. The triggers are kept in one table with the columns of TRIGGER_STORE_COLUMNS, and indexed with an R-tree over (channel, peak time, central frequency, SNR), or a B-tree over (channel, peak time) if SQLite was built without the R-tree module. Each ingested file is recorded with its modification time and size, so ingesting a tree of files again only reads the new or changed ones.
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+		self.conn.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER, ntriggers INTEGER)")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS channels (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS triggers (id INTEGER PRIMARY KEY, file_id INTEGER, channel_id INTEGER, peak REAL, %s)" % ", ".join(name for name, t in TRIGGER_STORE_COLUMNS))
+		self.conn.execute("CREATE INDEX IF NOT EXISTS triggers_file_id ON triggers (file_id)")
+		try:
+			self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS trigger_index USING rtree(id, min_channel, max_channel, min_peak, max_peak, min_freq, max_freq, min_snr, max_snr)")
+			self.rtree = True
+		except sqlite3.OperationalError:
+			self.conn.execute("CREATE INDEX IF NOT EXISTS triggers_channel_peak ON triggers (channel_id, peak)")
+			self.rtree = False
+
+	def _channel_id(self, name):
+		self.conn.execute("INSERT OR IGNORE INTO channels (name) VALUES (?)", (name,))
+		return self.conn.execute("SELECT id FROM channels WHERE name = ?", (name,)).fetchone()[0]
+
+	def _remove_file(self, file_id):
+		if self.rtree:
+			self.conn.execute("DELETE FROM trigger_index WHERE id IN (SELECT id FROM triggers WHERE file_id = ?)", (file_id,))
+		self.conn.execute("DELETE FROM triggers WHERE file_id = ?", (file_id,))
+		self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+	def ingest(self, paths, verbose=False):
+		"""
+		Add the triggers of the trigger files in paths which are new, or have changed since they were last ingested (replacing their old triggers). Each file is added in its own transaction. Returns the number of files read.
+		"""
+		nread = 0
+		for path in paths:
+			path = os.path.abspath(path)
+			stat = os.stat(path)
+			row = self.conn.execute("SELECT id, mtime, size FROM files WHERE path = ?", (path,)).fetchone()
+			if row is not None and (row[1], row[2]) == (stat.st_mtime, stat.st_size):
+				continue
+
+			arr = read_table_array(path, "sngl_burst")
+			self.conn.execute("BEGIN IMMEDIATE")
+			try:
+				if row is not None:
+					self._remove_file(row[0])
+				file_id = self.conn.execute("INSERT INTO files (path, mtime, size, ntriggers) VALUES (?, ?, ?, ?)", (path, stat.st_mtime, stat.st_size, len(arr))).lastrowid
+				self._insert(file_id, arr)
+				self.conn.execute("COMMIT")
+			except:
+				self.conn.execute("ROLLBACK")
+				raise
+			nread += 1
+			if verbose:
+				print "Ingested %d triggers from %s" % (len(arr), path)
+		return nread
+
+	def _insert(self, file_id, arr):
+		if not len(arr):
+			return
+		first = (self.conn.execute("SELECT MAX(id) FROM triggers").fetchone()[0] or 0) + 1
+		ids = numpy.arange(first, first + len(arr))
+		names = ["%s:%s" % key for key in zip(arr["ifo"], arr["channel"])]
+		chan_ids = dict((name, self._channel_id(name)) for name in set(names))
+		chan_id = numpy.array([chan_ids[name] for name in names])
+		peak = array_time(arr, "peak")
+
+		# Missing columns are stored as NULL
+		columns = []
+		for name, t in TRIGGER_STORE_COLUMNS:
+			columns.append(arr[name].tolist() if name in arr.dtype.names else [None] * len(arr))
+		self.conn.executemany("INSERT INTO triggers (id, file_id, channel_id, peak, %s) VALUES (%s)" % (", ".join(name for name, t in TRIGGER_STORE_COLUMNS), ",".join("?" * (len(TRIGGER_STORE_COLUMNS) + 4))), zip(ids.tolist(), [file_id] * len(arr), chan_id.tolist(), peak.tolist(), *columns))
+		if self.rtree:
+			freq, snr = arr["central_freq"].tolist(), arr["snr"].tolist()
+			self.conn.executemany("INSERT INTO trigger_index VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", zip(ids.tolist(), chan_id.tolist(), chan_id.tolist(), peak.tolist(), peak.tolist(), freq, freq, snr, snr))
+
+	def remove_missing(self):
+		"""
+		Remove the triggers of ingested files which no longer exist. Returns the number of files removed.
+		"""
+		missing = [(file_id, path) for file_id, path in self.conn.execute("SELECT id, path FROM files") if not os.path.exists(path)]
+		self.conn.execute("BEGIN IMMEDIATE")
+		try:
+			for file_id, path in missing:
+				self._remove_file(file_id)
+			self.conn.execute("COMMIT")
+		except:
+			self.conn.execute("ROLLBACK")
+			raise
+		return len(missing)
+
+	def channels(self):
+		"""
+		Get the names (e.g. H1:LSC-DARM_ERR) of the channels with triggers in the store.
+		"""
+		return [name for (name,) in self.conn.execute("SELECT name FROM channels WHERE id IN (SELECT DISTINCT channel_id FROM triggers) ORDER BY name")]
+
+	def query(self, channel, start=None, end=None, fmin=None, fmax=None, snr=None):
+		"""
+		Get the triggers of channel (e.g. H1:LSC-DARM_ERR) with peak times in [start, end), central frequencies in [fmin, fmax] and SNR of at least snr (any bound may be None), ordered by peak time. The triggers are returned as a structured array with the ifo, channel and TRIGGER_STORE_COLUMNS columns, as read_table_array would give them.
+		"""
+		row = self.conn.execute("SELECT id FROM channels WHERE name = ?", (channel,)).fetchone()
+		names = [name for name, t in TRIGGER_STORE_COLUMNS]
+		ifo, chan = channel.split(":", 1)
+		dtype = [("ifo", "S%d" % max(len(ifo), 1)), ("channel", "S%d" % max(len(chan), 1))] + list(TRIGGER_STORE_COLUMNS)
+		if row is None:
+			return numpy.empty(0, dtype=dtype)
+
+		# The R-tree holds 32 bit floats, rounded outwards, so it only
+		# narrows down the candidates and the exact bounds are checked
+		# against the table
+		where, params = ["t.channel_id = ?"], [row[0]]
+		for column, bound, op in (("peak", start, ">="), ("peak", end, "<"), ("central_freq", fmin, ">="), ("central_freq", fmax, "<="), ("snr", snr, ">=")):
+			if bound is not None:
+				where.append("t.%s %s ?" % (column, op))
+				params.append(bound)
+		sql = "SELECT %s FROM triggers AS t" % ", ".join("t." + name for name in names)
+		if self.rtree:
+			rwhere, rparams = ["r.min_channel <= ?", "r.max_channel >= ?"], [row[0], row[0]]
+			for column, bound, op in (("max_peak", start, ">="), ("min_peak", end, "<="), ("max_freq", fmin, ">="), ("min_freq", fmax, "<="), ("max_snr", snr, ">=")):
+				if bound is not None:
+					rwhere.append("r.%s %s ?" % (column, op))
+					rparams.append(bound)
+			sql = "SELECT %s FROM trigger_index AS r JOIN triggers AS t ON t.id = r.id" % ", ".join("t." + name for name in names)
+			where, params = rwhere + where, rparams + params
+		sql += " WHERE %s ORDER BY t.peak" % " AND ".join(where)
+
+		rows = self.conn.execute(sql, params).fetchall()
+		out = numpy.empty(len(rows), dtype=dtype)
+		out["ifo"], out["channel"] = ifo, chan
+		if rows:
+			for name, column in zip(names, zip(*rows)):
+				null = numpy.nan if out.dtype[name].kind == "f" else 0
+				out[name] = [null if v is None else v for v in column]
+		return out
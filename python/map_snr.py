@@ -160,14 +160,15 @@ def read_snrs(fname):
 
 if __name__ == "__main__":
     from glue.ligolw import utils
+    from burst_utils import sim_burst_snr_batch, psd_grid
     import sys
     xmldoc = utils.load_filename(sys.argv[1])
     sbt = lsctables.SimBurstTable.get_table(xmldoc)
 
     deltaF, fmax = 0.125, 4096.0
-    psd_len = fmax/deltaF
-    psd = map(lalsimulation.SimNoisePSDaLIGOZeroDetHighPower, 
-        numpy.linspace(0, psd_len, psd_len+1)*deltaF)
+    # Optional second argument: directory in which to keep the PSD grid
+    psd_cache_dir = len(sys.argv) > 2 and sys.argv[2] or None
+    psd = psd_grid("SimNoisePSDaLIGOZeroDetHighPower", deltaF, fmax, psd_cache_dir)
 
     ifos = ("H1", "L1", "V1")
 
@@ -178,10 +179,10 @@ if __name__ == "__main__":
         print >>fout, "# deltaF %e flow %e fhigh %e" % (deltaF, 0.0, fmax)
         print >>fout, "# simulation_id H1 L1 V1"
 
-        for sim in sbt:
-            sbw = SimBurstWaveform.from_SimBurst(sim)
+        snrs = sim_burst_snr_batch(sbt, dict((ifo, psd) for ifo in ifos), deltaF, ifos)
+        for sim, sim_snrs in zip(sbt, snrs):
             fout.write(str(sim.simulation_id) + " ")
-            print >>fout, " ".join("%e" % sbw.snr(psd, detector = ifo) for ifo in ifos)
+            print >>fout, " ".join("%e" % snr for snr in sim_snrs)
 
     #snrs = read_snrs("H1L1V1_snrs.txt")
     #print snrs.values()
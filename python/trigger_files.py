@@ -0,0 +1,204 @@
+import os
+import re
+import json
+import time
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+from glue.segments import segment, segmentlist
+from glue.lal import Cache, CacheEntry
+
+#
+# Trigger file discovery
+#
+
+# The layout of the trigger directories if the excesspower configuration
+# doesn't give one
+DEFAULT_OUTPUT_DIR_FORMAT = "%I/%C_excesspower/%G5/"
+
+# Number of directories listed at once
+DISCOVERY_THREADS = 16
+
+# A directory modified this recently (s) may still get files within the
+# resolution of its modification time, so its listing is not trusted
+DIRECTORY_SETTLE_TIME = 2
+
+_format_re = re.compile(r"%(G\d+|[iISCc%])")
+_trigger_file_re = re.compile(r"^[A-Z0-9]+-.+-(\d+(?:\.\d+)?)-(\d+(?:\.\d+)?)\.xml(?:\.gz)?$")
+
+def trigger_file_segment(path):
+    """
+    Get the span of a trigger file from its name (IFO-DESCRIPTION-START-DURATION.xml[.gz]), or None if it doesn't follow the convention.
+    """
+    m = _trigger_file_re.match(os.path.basename(path))
+    if m is None:
+        return None
+    start, dur = map(float, m.groups())
+    return segment(start, start+dur)
+
+def output_dir_format(cfg):
+    """
+    Get the output-dir-format of an excesspower configuration (a ConfigParser), or DEFAULT_OUTPUT_DIR_FORMAT if it doesn't have one.
+    """
+    for sec in cfg.sections():
+        if cfg.has_option(sec, "output-dir-format"):
+            return cfg.get(sec, "output-dir-format")
+    return DEFAULT_OUTPUT_DIR_FORMAT
+
+def expand_output_dir(fmt, channel, gps=None):
+    """
+    Expand the output-dir-format fmt for channel (e.g. H1:PSL-ISS_PDA_OUT_DQ) and a file starting at gps. The codes are those of gstlal_excesspower: %I is the instrument (H1), %i its first letter (H), %S the subsystem (PSL), %C the channel (PSL-ISS_PDA_OUT_DQ), %c the channel without the subsystem (ISS_PDA_OUT_DQ) and %G# the first # digits of gps.
+    """
+    instrument, chan = channel.split(":", 1)
+    subsys, _, rest = chan.partition("-")
+    def replace(m):
+        code = m.group(1)
+        if code.startswith("G"):
+            if gps is None:
+                raise ValueError("%s needs a GPS time" % m.group(0))
+            return str(int(gps))[:int(code[1:])]
+        return {"I": instrument, "i": instrument[0], "S": subsys, "C": chan, "c": rest or chan, "%": "%"}[code]
+    return _format_re.sub(replace, fmt)
+
+def _gps_blocks(seg, ndigits):
+    """
+    Get the first integer GPS time in seg of each block of times sharing their first ndigits digits, in time order, without counting through the times. Times with no more than ndigits digits are blocks of their own, so these are enumerated.
+    """
+    start, end = int(seg[0]), int(seg[1])
+    blocks = []
+    for width in range(len(str(start)), len(str(end)) + 1):
+        lo, hi = max(start, 10**(width-1) if width > 1 else 0), min(end, 10**width - 1)
+        if lo > hi:
+            continue
+        step = 10**max(width - ndigits, 0)
+        blocks.extend(max(lo, p*step) for p in range(lo // step, hi // step + 1))
+    return blocks
+
+class TriggerFileFinder(object):
+    """
+    Find the trigger files which gstlal_excesspower wrote for a channel over a span of time. The directories which can hold the files for the span are computed from the output-dir-format of the channel, rather than found by walking the tree, and are listed in parallel. If a manifest file is given, the listing and the spans of the files in each directory are kept in it, and a directory is only listed again if it has been modified since, so repeated searches only look at new files.
+    """
+    def __init__(self, output_dir, channel, fmt=DEFAULT_OUTPUT_DIR_FORMAT, manifest_file=None, nthreads=DISCOVERY_THREADS):
+        self.output_dir = os.path.abspath(output_dir)
+        self.channel = channel
+        self.fmt = fmt
+        self.manifest_file = manifest_file
+        self.nthreads = nthreads
+
+        self.manifest = {}
+        if manifest_file is not None and os.path.exists(manifest_file):
+            with open(manifest_file) as manf:
+                manifest = json.load(manf)
+            # A manifest for another layout is useless
+            if manifest.get("format") == fmt and manifest.get("output_dir") == self.output_dir:
+                self.manifest = manifest["directories"]
+        self._changed = False
+
+    @classmethod
+    def from_config(cls, cfg, channel, output_dir, **kwargs):
+        """
+        Create an instance from an excesspower configuration (a ConfigParser) for channel, writing to output_dir.
+        """
+        return cls(output_dir, channel, output_dir_format(cfg), **kwargs)
+
+    def directories(self, seg):
+        """
+        Get the directories which can hold the files starting within seg, in time order.
+        """
+        ndigits = [int(n) for n in re.findall(r"%G(\d+)", self.fmt)]
+        if not ndigits:
+            return [os.path.join(self.output_dir, expand_output_dir(self.fmt, self.channel))]
+        # The finest division of time determines the rest
+        dirs = []
+        for gps in _gps_blocks(seg, max(ndigits)):
+            path = os.path.join(self.output_dir, expand_output_dir(self.fmt, self.channel, gps))
+            if not dirs or dirs[-1] != path:
+                dirs.append(path)
+        return dirs
+
+    def _scan(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return path, None
+        entry = self.manifest.get(path)
+        if entry is not None and entry["mtime"] == mtime and mtime < entry["scanned"] - DIRECTORY_SETTLE_TIME:
+            return path, entry
+
+        # Only new names are parsed
+        known = entry["files"] if entry is not None else {}
+        files = {}
+        scanned = time.time()
+        for name in os.listdir(path):
+            if name in known:
+                files[name] = known[name]
+                continue
+            fseg = trigger_file_segment(name)
+            if fseg is not None:
+                files[name] = [fseg[0], fseg[1]]
+        return path, {"mtime": mtime, "scanned": scanned, "files": files}
+
+    def find(self, seg):
+        """
+        Get the trigger files which overlap seg, in time order. Files which start before seg[0] in an earlier directory are not found.
+        """
+        return self.find_all(segmentlist([seg]))
+
+    def find_all(self, segl):
+        """
+        Get the trigger files which overlap any segment of segl, in time order, see find. The directories of all of the segments are listed together, and the manifest is saved once.
+        """
+        segl = segmentlist(segl).coalesce()
+        dirs = []
+        for seg in segl:
+            dirs += [path for path in self.directories(seg) if path not in dirs]
+        if not dirs:
+            return []
+        pool = ThreadPool(min(self.nthreads, len(dirs)))
+        try:
+            scans = pool.map(self._scan, dirs)
+        finally:
+            pool.close()
+
+        found = []
+        for path, entry in scans:
+            if entry is None:
+                continue
+            if self.manifest.get(path) is not entry:
+                self.manifest[path] = entry
+                self._changed = True
+            for name, (start, end) in entry["files"].iteritems():
+                if segl.intersects_segment(segment(start, end)):
+                    found.append((start, os.path.join(path, name)))
+        if self.manifest_file is not None and self._changed:
+            self.save()
+        return [path for start, path in sorted(found)]
+
+    def segments(self, seg):
+        """
+        Get the time covered by the trigger files which overlap seg.
+        """
+        return segmentlist(filter(None, map(trigger_file_segment, self.find(seg)))).coalesce()
+
+    def write_cache(self, seg, cache_name):
+        """
+        Write a LAL cache of the trigger files which overlap seg, e.g. for the --input-cache of ligolw_bucluster. Returns the cache.
+        """
+        cache = Cache()
+        for path in self.find(seg):
+            fseg = trigger_file_segment(path)
+            ifo, desc = os.path.basename(path).split("-")[:2]
+            cache.append(CacheEntry(ifo, desc, fseg, "file://localhost" + path))
+        with open(cache_name, "w") as cachef:
+            cache.tofile(cachef)
+        return cache
+
+    def save(self):
+        """
+        Write the manifest of directory listings, replacing manifest_file atomically.
+        """
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.manifest_file)))
+        with os.fdopen(fd, "w") as manf:
+            json.dump({"format": self.fmt, "output_dir": self.output_dir, "directories": self.manifest}, manf)
+        os.rename(tmpname, self.manifest_file)
+        self._changed = False